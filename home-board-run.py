@@ -1,6 +1,20 @@
 #!/usr/bin/python3
+import argparse
 from homeboard import HomeBoard
+from homeboard.modules import dashboard_image
+
+parser = argparse.ArgumentParser(description='Render HomeBoard dashboard on e-paper display.')
+parser.add_argument('--serve', action='store_true', help='keep running and refresh on scheduler intervals')
+parser.add_argument('--build-icon-atlas', action='store_true', help='bake pre-scaled icons into one file and exit')
+args = parser.parse_args()
+
+if args.build_icon_atlas:
+    dashboard_image.buildIconAtlas()
+    raise SystemExit
 
 homeBoard = HomeBoard()
 
-homeBoard.run()
\ No newline at end of file
+if args.serve:
+    homeBoard.serve()
+else:
+    homeBoard.run()
@@ -1,5 +1,7 @@
 import os
 import json
+import sched
+import time
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -45,15 +47,58 @@ class HomeBoard:
         self.displayModule = display.DisplayModule(self.settings["configuration"]["display"])
 
     def run(self):
+        self.refreshWeather()
+        self.refreshDisplay()
+        self.displayModule.waitForRefresh()
+
+        return
+
+    def serve(self):
+        """
+        Runs HomeBoard as a long-lived process. Weather, calendars and the display are refreshed on separate timers,
+        so modules, fonts and the e-paper driver stay loaded between refreshes.
+        """
+        schedulerConfig = self.settings["configuration"].get("scheduler", {})
+        self.scheduler = sched.scheduler(time.monotonic, time.sleep)
+        # Calendars are fetched while building CalendarModule, so the first calendar refresh waits a full interval.
+        self.__scheduleTask(0, schedulerConfig.get("weather-interval", 600), 1, self.refreshWeather)
+        self.__scheduleTask(schedulerConfig.get("calendar-interval", 900), schedulerConfig.get("calendar-interval", 900), 1, self.refreshCalendars)
+        self.__scheduleTask(0, schedulerConfig.get("display-interval", 300), 2, self.refreshDisplay)
+        logger.info('HomeBoard scheduler started.')
+        try:
+            self.scheduler.run()
+        except KeyboardInterrupt:
+            logger.info('HomeBoard scheduler stopped.')
+            self.displayModule.waitForRefresh()
+
+    def refreshWeather(self):
         weatherData = self.weatherModule.getWeatherData()
-        logger.info(f'Weather data for {weatherData["cityName"]} - {weatherData["weatherStatus"]} Temp: {weatherData["temperature"]}, Humidity: {weatherData["humidity"]}% Wind: {weatherData["windSpeed"]} {weatherData["windDirection"]}')
+        if weatherData:
+            logger.info(f'Weather data for {weatherData["cityName"]} - {weatherData["weatherStatus"]} Temp: {weatherData["temperature"]}, Humidity: {weatherData["humidity"]}% Wind: {weatherData["windSpeed"]} {weatherData["windDirection"]}')
+
+    def refreshCalendars(self):
+        self.calendarModule.refreshCalendars()
+
+    def refreshDisplay(self):
+        # Read from the weather cache on every refresh, so data refreshed in the background is shown right away.
+        weatherData = self.weatherModule.getWeatherData()
+        if not weatherData:
+            logger.warning('No weather data available. Skipping display refresh.')
+            return
         todayEvents = self.calendarModule.getTodaysEvents()
         tomorrowEvents = self.calendarModule.getTomorrowsEvents()
         nextDaysEvents = self.calendarModule.getEventsForFiveDays()
-        self.imageModule.testImage(todayEvents, tomorrowEvents, nextDaysEvents, weatherData)
-        self.displayModule.displayImage(self.imageModule.renderDashboardImage(todayEvents, tomorrowEvents, nextDaysEvents, weatherData))
+        image, dirtyBoxes = self.imageModule.renderDashboardImage(todayEvents, tomorrowEvents, nextDaysEvents, weatherData)
+        self.displayModule.displayImage(image, dirtyBoxes)
 
-        return
+    def __scheduleTask(self, delay, interval, priority, task):
+        def runTask():
+            try:
+                task()
+            except Exception as ex:
+                logger.error(f'Scheduled task {task.__name__} failed: {ex}')
+            self.scheduler.enter(interval, priority, runTask)
+        self.scheduler.enter(delay, priority, runTask)
 
     def loadSettings(self):
         settingsPath = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir, 'config.json'))
@@ -1,36 +1,92 @@
 #!/usr/bin/python3
 import arrow
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import os
+import pickle
 import requests
+import threading
 import time
 import recurring_ical_events
+from concurrent import futures
+from datetime import datetime, timedelta
 from icalendar import Calendar
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
 logger = logging.getLogger(__name__)
 
 fmt = lambda date: (date.year, date.month, date.day, date.hour, date.minute, date.second)
 
+projectPath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
 class CalendarModule:
     def __init__(self, config):
         self.calendars = config["icalendars"]
         self.timezone = config["timezone"]
-        self.icalendars = [iCalendar(calendar[0], calendar[1]) for calendar in self.calendars]
-        if len(self.calendars) > len(self.icalendars):
-            logger.warning(f'Some of calendars not loaded properly!')
+        self.tzinfo = arrow.parser.TzinfoParser.parse(self.timezone)
+        self.cache = FeedCache(config.get("cache-path") or f'{projectPath}/cache')
+        self.maxAge = config.get("max-age", 0)
+        self.fetchTimeout = config.get("fetch-timeout", 10)
+        self.fetchDeadline = config.get("fetch-deadline", 30)
+        workers = max(min(len(self.calendars), 8), 1)
+        # One keep-alive connection pool shared by all feeds, sized so that parallel fetches do not discard connections.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='calendar')
+        self.pendingFetches = {}
+        # Calendars are kept between refreshes, so a feed that did not change is not parsed again.
+        self.icalendars = [iCalendar(calendar[0], calendar[1], self.cache, self.maxAge, self.session, self.fetchTimeout)
+                           for calendar in self.calendars]
+        self.eventIndexes = {}
+        # indexes are updated by fetch workers and by renders
+        self.indexLock = threading.Lock()
+        for calendar in self.icalendars:
+            index = self.__loadEventIndex(calendar)
+            if index:
+                self.eventIndexes[calendar] = index
+        # With a snapshot of every calendar the dashboard can be rendered right away, feeds are revalidated meanwhile.
+        self.refreshCalendars(wait=len(self.eventIndexes) < len(self.icalendars))
+
+    def refreshCalendars(self, wait=True):
+        """
+        Fetches all calendars in parallel and waits at most fetch-deadline seconds for them, or not at all when
+        wait is False. Calendars that are still being fetched keep their previous data and are updated in the
+        background once their fetch finishes.
+        """
+        startTime = time.time()
+        for calendar in self.icalendars:
+            pendingFetch = self.pendingFetches.get(calendar)
+            if pendingFetch and not pendingFetch.done():
+                logger.warning(f'Calendar {calendar.name} is still being fetched, skipping it.')
+                continue
+            self.pendingFetches[calendar] = self.executor.submit(self.__refreshCalendar, calendar)
+        if not wait:
+            logger.info('Calendars are refreshed in the background.')
+            return
+        done, notDone = futures.wait(self.pendingFetches.values(), timeout=self.fetchDeadline)
+        logger.info(f'Calendars refreshed. Took {(time.time() - startTime):.2f}s.')
+        if notDone:
+            logger.warning(f'{len(notDone)} calendars not fetched within {self.fetchDeadline}s!')
+        notLoaded = [calendar.name for calendar in self.icalendars if calendar.calendar is None]
+        if notLoaded:
+            logger.warning(f'Some of calendars not loaded properly: {", ".join(notLoaded)}!')
 
     def getTodaysEvents(self, count=5):
         startTimeline = arrow.utcnow()
         startTimeline = arrow.get(startTimeline.date())
         endTimeline = startTimeline.shift(days = 1)
-        tStart = fmt(startTimeline)
-        tEnd = fmt(endTimeline)
-        recurringEvents = ((calendar.name, recurring_ical_events.of(calendar.calendar).between(tStart, tEnd)) for calendar in self.icalendars)
-        events = self.__convertToEventList(recurringEvents)
-        sortedEvents = CalendarModule.sortEvents(events)
-        # print(f'Today\'s events:\n{str(sortedEvents[0:count])}')
+        tStart = datetime(*fmt(startTimeline))
+        tEnd = datetime(*fmt(endTimeline))
+        sortedEvents = CalendarModule.mergeEvents((index.between(tStart, tEnd) for index in self.__getEventIndexes()), count)
+        # print(f'Today\'s events:\n{str(sortedEvents)}')
         if sortedEvents:
-            return sortedEvents[0:count]
+            return sortedEvents
         else:
             return None
 
@@ -38,14 +94,12 @@ class CalendarModule:
         startTimeline = arrow.utcnow().shift(days = 1)
         startTimeline = arrow.get(startTimeline.date())
         endTimeline = startTimeline.shift(days = 1)
-        tStart = fmt(startTimeline)
-        tEnd = fmt(endTimeline)
-        recurringEvents = ((calendar.name, recurring_ical_events.of(calendar.calendar).between(tStart, tEnd)) for calendar in self.icalendars)
-        events = self.__convertToEventList(recurringEvents)
-        sortedEvents = CalendarModule.sortEvents(events)
-        # print(f'Tomorrow\'s events:\n{str(sortedEvents[0:count])}')
+        tStart = datetime(*fmt(startTimeline))
+        tEnd = datetime(*fmt(endTimeline))
+        sortedEvents = CalendarModule.mergeEvents((index.between(tStart, tEnd) for index in self.__getEventIndexes()), count)
+        # print(f'Tomorrow\'s events:\n{str(sortedEvents)}')
         if sortedEvents:
-            return sortedEvents[0:count]
+            return sortedEvents
         else:
             return None
 
@@ -53,73 +107,361 @@ class CalendarModule:
         startTimeline = arrow.utcnow().shift(days = 2)
         startTimeline = arrow.get(startTimeline.date())
         endTimeline = startTimeline.shift(days = 6)
-        tStart = fmt(startTimeline)
-        tEnd = fmt(endTimeline)
-        recurringEvents = ((calendar.name, recurring_ical_events.of(calendar.calendar).between(tStart, tEnd)) for calendar in self.icalendars)
-        events = self.__convertToEventList(recurringEvents)
-        sortedEvents = CalendarModule.sortEvents(events)
-        # print(f'Next five day\'s events:\n{str(sortedEvents[0:count])}')
+        tStart = datetime(*fmt(startTimeline))
+        tEnd = datetime(*fmt(endTimeline))
+        sortedEvents = CalendarModule.mergeEvents((index.between(tStart, tEnd) for index in self.__getEventIndexes()), count)
+        # print(f'Next five day\'s events:\n{str(sortedEvents)}')
+        if sortedEvents:
+            return sortedEvents
+        else:
+            return None
+
+    def getUpcomingEvents(self, count=5, after=None):
+        """
+        Returns up to count events beginning at or after the arrow time after (now by default). Only events
+        covered by the event indexes, at least until the end of the seventh day from today, are returned.
+        """
+        after = after or arrow.utcnow()
+        sortedEvents = CalendarModule.mergeEvents((index.after(after, count) for index in self.__getEventIndexes()), count)
         if sortedEvents:
-            return sortedEvents[0:count]
+            return sortedEvents
         else:
             return None
 
+    def __refreshCalendar(self, calendar):
+        # The index and its snapshot are updated as soon as the feed is fetched, not on the next render, so a
+        # one-shot run that rendered from an old snapshot still leaves an up to date one for the next run.
+        calendar.refresh()
+        self.__getEventIndex(calendar, arrow.get(arrow.utcnow().date()))
+
+    def __getEventIndexes(self):
+        """
+        Returns the event index of every loaded calendar. An index covers at least today and the following seven
+        days, which covers all event lists shown on the dashboard. It is rebuilt only when it stops covering them
+        or its calendar is replaced by a newly fetched feed. A snapshot index is used until its calendar is fetched.
+        """
+        startTimeline = arrow.get(arrow.utcnow().date())
+        indexes = [self.__getEventIndex(calendar, startTimeline) for calendar in self.icalendars]
+        return [index for index in indexes if index]
+
+    def __getEventIndex(self, calendar, startTimeline):
+        with self.indexLock:
+            index = self.eventIndexes.get(calendar)
+            source, feedHash = calendar.getCalendar()
+            if source and (not index or index.calendar is not source):
+                if index and index.feed == feedHash and index.covers(startTimeline):
+                    # feed did not change since the index was built, e.g. it was loaded from a snapshot
+                    index.calendar = source
+                else:
+                    index = None
+            if index and not index.covers(startTimeline):
+                index = None
+            if not index and source:
+                index = self.__buildEventIndex(calendar, source, feedHash, startTimeline)
+            if index:
+                self.eventIndexes[calendar] = index
+            return index
+
+    def __buildEventIndex(self, calendar, source, feedHash, startTimeline):
+        startTime = time.time()
+        tStart = fmt(startTimeline)
+        tEnd = fmt(startTimeline.shift(days = EventIndex.DAYS))
+        components = recurring_ical_events.of(source).between(tStart, tEnd)
+        events = self.__convertToEventList([(calendar.name, components)])
+        spans = [(component.get('DTSTART').dt, component.get('DTEND').dt) for component in components]
+        index = EventIndex(feedHash, startTimeline, self.timezone, events, spans)
+        index.calendar = source
+        logger.info(f'Indexed {len(components)} events of calendar {calendar.name}. Took {(time.time() - startTime):.2f}s.')
+        if calendar.url:
+            self.cache.storeSnapshot(calendar.url, index.getSnapshot())
+        return index
+
+    def __loadEventIndex(self, calendar):
+        snapshot = self.cache.getSnapshot(calendar.url) if calendar.url else None
+        index = EventIndex.fromSnapshot(snapshot, self.timezone) if snapshot else None
+        if not index or not index.covers(arrow.get(arrow.utcnow().date())):
+            return None
+        logger.info(f'Loaded snapshot of {len(index.events)} events of calendar {calendar.name}.')
+        return index
+
     def __convertToEventList(self, recurringEvents):
-        return list(
-            {
-                'title': event.get('SUMMARY').lstrip(),
+        return [self.__convertEvent(event, calendar[0]) for calendar in recurringEvents for event in calendar[1]]
 
-                'begin': arrow.get(event.get('DTSTART').dt).to(self.timezone) if (
-                        arrow.get(event.get('DTSTART').dt).format('HH:mm') != '00:00')
-                else arrow.get(event.get('DTSTART').dt).replace(tzinfo=self.timezone),
+    def __convertEvent(self, event, owner):
+        # Timed events are moved to the configured timezone, events starting at midnight keep their wall-clock time.
+        begin = arrow.get(event.get('DTSTART').dt)
+        end = arrow.get(event.get('DTEND').dt)
+        if begin.hour or begin.minute:
+            begin, end = begin.to(self.tzinfo), end.to(self.tzinfo)
+        else:
+            begin, end = begin.replace(tzinfo=self.tzinfo), end.replace(tzinfo=self.tzinfo)
+        return Event(event.get('SUMMARY').lstrip(), begin, end, owner)
 
-                'end': arrow.get(event.get('DTEND').dt).to(self.timezone) if (
-                        arrow.get(event.get('dtstart').dt).format('HH:mm') != '00:00')
-                else arrow.get(event.get('DTEND').dt).replace(tzinfo=self.timezone),
+    @staticmethod
+    def mergeEvents(eventLists, count):
+        """
+        Merges event lists sorted by begin into the first count events. The lists are consumed lazily and only as
+        far as needed, events with the same begin keep the order of their lists.
+        """
+        byDate = lambda event: event.begin
+        return list(itertools.islice(heapq.merge(*eventLists, key=byDate), count))
 
-                'owner': calendar[0]
-            } for calendar in recurringEvents for event in calendar[1]
-        )
+    @staticmethod
+    def isSpanInSpan(begin, end, tStart, tEnd):
+        """
+        Tells whether the span of an expanded event overlaps the span between the naive datetimes tStart and tEnd
+        (exclusive). Dates are taken as midnight and the span is read in the event's timezone, like
+        recurring_ical_events does.
+        """
+        tzinfo = next((value.tzinfo for value in (begin, end) if isinstance(value, datetime) and value.tzinfo), None)
+        begin, end, tStart, tEnd = (CalendarModule.__toDatetime(value, tzinfo) for value in (begin, end, tStart, tEnd))
+        if begin == end:
+            return tStart <= begin < tEnd
+        return begin < tEnd and tStart < end
 
     @staticmethod
-    def sortEvents(events):
-        if not events:
-            logger.debug(f'Cannot sort empty event list.')
-        else:
-            byDate = lambda event: event['begin']
-            events.sort(key=byDate)
-            return events
+    def __toDatetime(value, tzinfo):
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        if value.tzinfo is None and tzinfo is not None:
+            return tzinfo.localize(value) if hasattr(tzinfo, 'localize') else value.replace(tzinfo=tzinfo)
+        return value
 
     @staticmethod
     def isEventAllDay(event):
-        if not ('end' and 'begin') in event:
-            logger.debug(f'Not a valid event. Must have start and end date.')
-            raise Exception('Not valid event!')
-        begin, end = event['begin'], event['end']
-        duration = end - begin
-        return (begin.format('HH:mm') == '00:00' and end.format('HH:mm') == '00:00' and duration.days >=1)
+        return event.allDay
+
+class Event:
+    """
+    Event normalized for display. begin and end are arrow times in the configured timezone, allDay tells whether
+    the event spans whole days, so it is shown without hours.
+    """
+
+    __slots__ = ('title', 'begin', 'end', 'owner', 'allDay')
+
+    def __init__(self, title, begin, end, owner):
+        self.title = title
+        self.begin = begin
+        self.end = end
+        self.owner = owner
+        self.allDay = (begin.hour == begin.minute == 0 and end.hour == end.minute == 0 and (end - begin).days >= 1)
+
+    def __repr__(self):
+        return f'Event<{self.title}, {self.begin} - {self.end}, {self.owner}>'
+
+class EventIndex:
+    """
+    Events of one calendar for a day and the following two weeks, converted once and sorted by begin.
+    Range queries bisect the sorted begins, so only events that can overlap the range are looked at.
+    The index can be stored as a snapshot, so it does not have to be rebuilt from the feed after a restart.
+    """
+
+    # Bump when the snapshot content changes, older snapshots are ignored then.
+    SNAPSHOT_VERSION = 1
+    # Days of events in the index, queries cover up to eight days from the day they are made.
+    DAYS = 15
+    # A naive span is read in each event's timezone, which moves it against UTC by less than this.
+    SPAN_SLACK = timedelta(days = 2)
+
+    def __init__(self, feed, day, timezone, events, spans):
+        # Parsed calendar the index was built from, None for an index loaded from a snapshot.
+        self.calendar = None
+        self.feed = feed
+        self.day = day
+        self.timezone = timezone
+        order = sorted(range(len(events)), key=lambda i: events[i].begin)
+        self.events = [events[i] for i in order]
+        # DTSTART and DTEND as given by the feed, spans are matched against them
+        self.spans = [spans[i] for i in order]
+        self.begins = [event.begin for event in self.events]
+        self.maxDuration = max((event.end - event.begin for event in self.events), default=timedelta(0))
+
+    def covers(self, day):
+        return self.day <= day and day.shift(days = 8) <= self.day.shift(days = EventIndex.DAYS)
+
+    def between(self, tStart, tEnd):
+        # Yields events overlapping the span between the naive datetimes tStart and tEnd, sorted by begin.
+        low = bisect.bisect_left(self.begins, arrow.get(tStart) - self.maxDuration - EventIndex.SPAN_SLACK)
+        high = bisect.bisect_left(self.begins, arrow.get(tEnd) + EventIndex.SPAN_SLACK)
+        return (self.events[i] for i in range(low, high) if CalendarModule.isSpanInSpan(*self.spans[i], tStart, tEnd))
+
+    def after(self, moment, count):
+        # First count events beginning at or after the arrow time moment.
+        low = bisect.bisect_left(self.begins, moment)
+        return self.events[low:low + count]
+
+    def getSnapshot(self):
+        return {
+            'version': EventIndex.SNAPSHOT_VERSION,
+            'feed': self.feed,
+            'day': self.day.date().isoformat(),
+            'days': EventIndex.DAYS,
+            'timezone': self.timezone,
+            'events': [(event.title, event.begin, event.end, event.owner) for event in self.events],
+            'spans': self.spans
+        }
+
+    @staticmethod
+    def fromSnapshot(snapshot, timezone):
+        # Returns None when the snapshot was made by another version or for another timezone.
+        try:
+            if (snapshot['version'], snapshot['days'], snapshot['timezone']) != (EventIndex.SNAPSHOT_VERSION, EventIndex.DAYS, timezone):
+                return None
+            events = [Event(*event) for event in snapshot['events']]
+            return EventIndex(snapshot['feed'], arrow.get(snapshot['day']), timezone, events, snapshot['spans'])
+        except (KeyError, TypeError, ValueError) as ex:
+            logger.warning(f'Calendar snapshot cannot be read: {ex}')
+            return None
+
+class FeedCache:
+    """
+    On-disk cache of iCalendar feeds. Each feed is stored as its raw body next to a JSON file with the ETag and
+    Last-Modified headers it was served with and the time it was last fetched, and a pickled snapshot of its
+    event index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as ex:
+            logger.warning(f'Cannot create calendar cache in {path}: {ex}')
+
+    def getEntry(self, url):
+        try:
+            with open(self.__entryPath(url, 'json')) as entryFile:
+                return json.load(entryFile)
+        except (OSError, ValueError):
+            return None
+
+    def getBody(self, url):
+        try:
+            with open(self.__entryPath(url, 'ics'), 'rb') as bodyFile:
+                return bodyFile.read()
+        except OSError:
+            return None
+
+    def store(self, url, body, etag, lastModified):
+        try:
+            with open(self.__entryPath(url, 'ics'), 'wb') as bodyFile:
+                bodyFile.write(body)
+            self.__storeEntry(url, {'etag': etag, 'last-modified': lastModified, 'fetched': time.time()})
+        except OSError as ex:
+            logger.warning(f'Cannot store calendar in cache: {ex}')
+
+    def getSnapshot(self, url):
+        try:
+            with open(self.__entryPath(url, 'pickle'), 'rb') as snapshotFile:
+                return pickle.load(snapshotFile)
+        except OSError:
+            return None
+        except Exception as ex:
+            logger.warning(f'Calendar snapshot cannot be loaded: {ex}')
+            return None
+
+    def storeSnapshot(self, url, snapshot):
+        snapshotPath = self.__entryPath(url, 'pickle')
+        try:
+            with open(f'{snapshotPath}.tmp', 'wb') as snapshotFile:
+                pickle.dump(snapshot, snapshotFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f'{snapshotPath}.tmp', snapshotPath)
+        except Exception as ex:
+            logger.warning(f'Cannot store calendar snapshot: {ex}')
+
+    def touch(self, url, entry):
+        try:
+            self.__storeEntry(url, dict(entry, fetched=time.time()))
+        except OSError as ex:
+            logger.warning(f'Cannot update calendar cache entry: {ex}')
+
+    def __storeEntry(self, url, entry):
+        # written to a temporary file first, so a crash never leaves a half written entry behind
+        entryPath = self.__entryPath(url, 'json')
+        with open(f'{entryPath}.tmp', 'w') as entryFile:
+            json.dump(entry, entryFile)
+        os.replace(f'{entryPath}.tmp', entryPath)
+
+    def __entryPath(self, url, extension):
+        return os.path.join(self.path, f'{hashlib.sha1(url.encode()).hexdigest()}.{extension}')
 
 class iCalendar:
-    def __init__(self, name, url):
+    def __init__(self, name, url, cache=None, maxAge=0, session=None, timeout=None):
         self.name = name
         self.url = url
+        self.cache = cache
+        self.maxAge = maxAge
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.calendar = None
+        # SHA-1 of the feed the calendar was parsed from
+        self.feedHash = None
+        # calendars are refreshed on worker threads, the lock keeps the calendar and its hash consistent
+        self.lock = threading.Lock()
+
+    def refresh(self):
         if self.url:
-            self.calendar = self.getCalendarData()
+            calendar, feedHash = self.getCalendarData()
+            with self.lock:
+                self.calendar, self.feedHash = calendar, feedHash
+
+    def getCalendar(self):
+        with self.lock:
+            return self.calendar, self.feedHash
 
     def getCalendarData(self):
+        """
+        Returns the parsed calendar and the hash of its feed. A cached feed younger than max-age is used without asking the server,
+        otherwise the feed is requested conditionally and only parsed again when the server sends a new body.
+        The cached feed is used when the server cannot be reached.
+        """
+        entry = self.cache.getEntry(self.url) if self.cache else None
+        if entry and time.time() - entry["fetched"] < self.maxAge:
+            calendar, feedHash = self.__getKnownCalendar()
+            if calendar:
+                logger.info(f'Calendar {self.name} fetched less than {self.maxAge}s ago, using cached feed.')
+                return calendar, feedHash
+        headers = {}
+        if entry and (self.calendar or self.cache.getBody(self.url) is not None):
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last-modified"]:
+                headers["If-Modified-Since"] = entry["last-modified"]
         logger.info(f'Executing API call for calendar {self.name}.')
         try:
             startTime = time.time()
-            response = requests.get(self.url)
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             endTime = time.time()
             logger.info(f'API call for calendar {self.name} executed. Took {(endTime - startTime):.2f}s.')
-            calendar = Calendar.from_ical(response.text)
-            return calendar
+            if response.status_code == 304:
+                calendar, feedHash = self.__getKnownCalendar()
+                if calendar:
+                    logger.info(f'Calendar {self.name} not modified, using cached feed.')
+                    self.cache.touch(self.url, entry)
+                    return calendar, feedHash
+                response = self.session.get(self.url, timeout=self.timeout)
+                response.raise_for_status()
+            calendar = Calendar.from_ical(response.content)
+            if self.cache:
+                self.cache.store(self.url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+            return calendar, hashlib.sha1(response.content).hexdigest()
         except HTTPError as httpError:
             logger.error(f'HTTP error occurred: {httpError}')
         except Exception as ex:
             logger.error(f'Exception occurred: {ex}')
+        return self.__getKnownCalendar()
+
+    def __getKnownCalendar(self):
+        if self.calendar:
+            return self.calendar, self.feedHash
+        body = self.cache.getBody(self.url) if self.cache else None
+        if body is None:
+            return None, None
+        try:
+            return Calendar.from_ical(body), hashlib.sha1(body).hexdigest()
+        except Exception as ex:
+            logger.error(f'Cached calendar {self.name} cannot be parsed: {ex}')
+            return None, None
 
     def __str__(self):
         return f'iCalendar<{self.name}>'
\ No newline at end of file
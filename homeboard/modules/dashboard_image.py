@@ -1,9 +1,13 @@
+import functools
+import json
 import logging
+import mmap
 import os
 import io
 import arrow
-from PIL import Image, ImageDraw, ImageFont
-from homeboard.modules import calendar
+from concurrent import futures
+from PIL import Image, ImageFont
+from homeboard.modules.layout import Layout, Widget
 
 logger = logging.getLogger(__name__)
 
@@ -26,15 +30,87 @@ def openPngSize(name, width, height):
         image = image.resize((output_width,height))
     return image
 
+def toMask(alpha, mode):
+    # draw.bitmap on a mode 1 image only inks pixels where the mask is fully opaque.
+    if mode == '1':
+        return alpha.point([0] * 255 + [255], '1')
+    return alpha.convert(mode)
+
+@functools.lru_cache(maxsize=64)
+def getIcon(name, width, height, mode='1'):
+    """
+    Returns the icon scaled like openPngSize does, as a draw.bitmap mask of the given mode. Icons are taken from
+    the icon atlas when it has them and decoded from images otherwise, either way only once.
+    The returned image is shared between calls and must not be modified.
+    """
+    alpha = iconAtlas.getAlpha(name, width, height) if iconAtlas else None
+    if alpha is None:
+        alpha = openPngSize(name, width, height).getchannel('A')
+    return toMask(alpha, mode)
+
+class IconAtlas:
+    """
+    Alpha channels of pre-scaled icons stacked into one raw 8-bit image, which is memory-mapped instead of read.
+    An index file next to it maps (name, width, height) to the icon's box in the atlas.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        with open(f'{path}.json') as indexFile:
+            index = json.load(indexFile)
+        if index["version"] != IconAtlas.VERSION:
+            raise ValueError(f'unsupported icon atlas version {index["version"]}')
+        self.boxes = index["icons"]
+        with open(path, 'rb') as atlasFile:
+            self.map = mmap.mmap(atlasFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.image = Image.frombuffer('L', tuple(index["size"]), self.map, 'raw', 'L', 0, 1)
+
+    def getAlpha(self, name, width, height):
+        box = self.boxes.get(f'{name}:{width}x{height}')
+        return self.image.crop(box) if box else None
+
+    @staticmethod
+    def build(path, icons):
+        """
+        Bakes icons, a list of (name, width, height), into an atlas at path.
+        """
+        alphas = [(f'{name}:{width}x{height}', openPngSize(name, width, height).getchannel('A')) for name, width, height in icons]
+        size = (max(alpha.size[0] for key, alpha in alphas), sum(alpha.size[1] for key, alpha in alphas))
+        atlas = Image.new('L', size, 0)
+        boxes = {}
+        top = 0
+        for key, alpha in alphas:
+            boxes[key] = (0, top, alpha.size[0], top + alpha.size[1])
+            atlas.paste(alpha, (0, top))
+            top += alpha.size[1]
+        with open(path, 'wb') as atlasFile:
+            atlasFile.write(atlas.tobytes())
+        with open(f'{path}.json', 'w') as indexFile:
+            json.dump({"version": IconAtlas.VERSION, "size": size, "icons": boxes}, indexFile)
+        logger.info(f'Icon atlas with {len(boxes)} icons built in {path}.')
+
+iconAtlas = None
+
+def loadIconAtlas(path):
+    global iconAtlas
+    try:
+        iconAtlas = IconAtlas(path)
+        getIcon.cache_clear()
+        logger.info(f'Icon atlas loaded from {path}.')
+    except (OSError, ValueError, KeyError) as ex:
+        logger.warning(f'Cannot load icon atlas {path}, icons are decoded from images: {ex}')
+
 #Icons
 # temperatureIconPng = cairo.ImageSurface(cairo.FORMAT_A1, 25, 25)
 # temperatureIconPng = cairo.svg2png(url=os.path.join(svgsPath, 'temperature-three-quarters.svg'), output_width=25, output_height=25)
 # temperatureIcon = Image.frombytes('1', (25,25), temperatureIconPng)
-temperatureIcon = openPngSize('temperature-three-quarters.png', 25, 25)
-dropletIcon = openPngSize('droplet.png', 25, 25)
-pressureIcon = openPngSize('arrows-down-to-line.png', 25, 25)
-windIcon = openPngSize('wind.png', 25, 25)
-arrowIcon = openPngSize('arrow-up.png', 50, 50)
+TEMPERATURE_ICON = ('temperature-three-quarters.png', 25, 25)
+DROPLET_ICON = ('droplet.png', 25, 25)
+PRESSURE_ICON = ('arrows-down-to-line.png', 25, 25)
+WIND_ICON = ('wind.png', 25, 25)
+ARROW_ICON = ('arrow-up.png', 50, 50)
+STATUS_ICON_SIZE = (150, 150)
 
 statusImageNameDict = {
     "01d": "sun.png",
@@ -57,164 +133,141 @@ statusImageNameDict = {
     "50n": "smog.png"
 }
 
+# every icon the dashboard draws, baked into the icon atlas
+DASHBOARD_ICONS = [TEMPERATURE_ICON, DROPLET_ICON, PRESSURE_ICON, WIND_ICON, ARROW_ICON] + [
+    (name, *STATUS_ICON_SIZE) for name in sorted(set(statusImageNameDict.values()))]
+ICON_ATLAS_PATH = os.path.join(IMAGES_PATH, 'icons.atlas')
 
-testFile = os.path.abspath(os.path.join(__file__, os.pardir, 'test.bmp'))
-DEGREE_SIGN = u'\N{DEGREE SIGN}'
+def buildIconAtlas(path=ICON_ATLAS_PATH):
+    IconAtlas.build(path, DASHBOARD_ICONS)
 
-class ImageModule:
 
-    def __init__(self, config):
-        self.locale = config["locale"]
-        return
+SNAPSHOTS_PATH = os.path.abspath(os.path.join(__file__, os.pardir))
+DEGREE_SIGN = u'\N{DEGREE SIGN}'
 
-    def renderDashboardImage(self, todayEvents, tomorrowEvents, nextDaysEvents, weatherData):
-        logger.info('Start of rendering dashboard image.')
-        today = arrow.utcnow().format('dddd DD. MMMM YYYY', locale=self.locale)
-        image = Image.new('1', (800,480), 255)
-        draw = ImageDraw.Draw(image)
+class LinesWidget(Widget):
+    """
+    Lines separating the weather panel, the date header and the event lists.
+    """
 
-        # Lines
+    def draw(self, draw, data):
         draw.line([(200,0),(200,480)], fill="Black", width=2)
         draw.line([(200,60),(800,60)], fill="Black", width=2)
         draw.line([(200,200),(800,200)], fill="Black", width=1)
         draw.line([(200,340),(800,340)], fill="Black", width=1)
 
-        # Weather
-        statusIcon = openPngSize(statusImageNameDict[weatherData["weatherStatus"]], 150, 150)
-        draw.bitmap((25,30), statusIcon)
-
-        draw.text((100,200), f'{weatherData["cityName"]}', font=FONT_LATO_BOLD, anchor="ma")
+class WeatherWidget(Widget):
+    """
+    Status icon, city name and weather values, data is the weather data of WeatherModule.
+    """
 
-        FONT_LATO_BOLD.size = 32
+    def draw(self, draw, weatherData):
+        statusIcon = getIcon(statusImageNameDict[weatherData["weatherStatus"]], *STATUS_ICON_SIZE)
+        draw.bitmap((25,30), statusIcon)
 
-        draw.bitmap((40, 250), temperatureIcon)
-        draw.text((65, 250), f'{weatherData["temperature"]} {DEGREE_SIGN}C', font=FONT_LATO_BOLD)
+        self.drawText(draw, (100,200), f'{weatherData["cityName"]}', FONT_LATO_BOLD, anchor="ma")
 
-        draw.bitmap((40, 285), dropletIcon)
-        draw.text((65, 285), f'{weatherData["humidity"]} %', font=FONT_LATO_BOLD)
+        draw.bitmap((40, 250), getIcon(*TEMPERATURE_ICON))
+        self.drawText(draw, (65, 250), f'{weatherData["temperature"]} {DEGREE_SIGN}C', FONT_LATO_BOLD)
 
-        draw.bitmap((35, 320), pressureIcon)
-        draw.text((65, 320), f'{weatherData["pressure"]} hPa', font=FONT_LATO_BOLD)
+        draw.bitmap((40, 285), getIcon(*DROPLET_ICON))
+        self.drawText(draw, (65, 285), f'{weatherData["humidity"]} %', FONT_LATO_BOLD)
 
-        draw.bitmap((35,355), windIcon)
-        draw.text((65,355), f'{weatherData["windSpeed"]} m/s', font=FONT_LATO_BOLD)
+        draw.bitmap((35, 320), getIcon(*PRESSURE_ICON))
+        self.drawText(draw, (65, 320), f'{weatherData["pressure"]} hPa', FONT_LATO_BOLD)
 
-        FONT_LATO_BOLD.size = 22
+        draw.bitmap((35,355), getIcon(*WIND_ICON))
+        self.drawText(draw, (65,355), f'{weatherData["windSpeed"]} m/s', FONT_LATO_BOLD)
 
-        arrowIcn = arrowIcon.rotate(angle=(180 - weatherData["windDirection"]))
+        arrowIcn = getIcon(*ARROW_ICON).rotate(angle=(180 - weatherData["windDirection"]))
         draw.bitmap((75, 385), arrowIcn)
 
-        # Date
-        draw.text((500,30), f'{today}', font=FONT_ROBOTO_SERIF, anchor="mm")
-
-        #Today
-        draw.text((205,65), "Dzisiaj", font=FONT_LATO_BOLD)
-        if todayEvents:
-            for idx, event in enumerate(todayEvents):
-                draw.text((205,(97 + idx * 19)), event['title'], font=FONT_LATO)
-                draw.text((650,(97 + idx * 19)), event['owner'], font=FONT_LATO, anchor="ma")
-                if calendar.CalendarModule.isEventAllDay(event):
-                    draw.text((750,(97 + idx * 19)), "cały dzień", font=FONT_LATO, anchor="ma")
-                else:
-                    draw.text((750,(97 + idx * 19)), f'{event["begin"].format("HH:mm")} - {event["end"].format("HH:mm")}', font=FONT_LATO, anchor="ma")
-
-        #Tomorrow
-        draw.text((205, 205), "Jutro", font=FONT_LATO_BOLD)
-        if tomorrowEvents:
-            for idx, event in enumerate(tomorrowEvents):
-                draw.text((205,(236 + idx * 19)), event['title'], font=FONT_LATO)
-                draw.text((650,(236 + idx * 19)), event['owner'], font=FONT_LATO, anchor="ma")
-                if calendar.CalendarModule.isEventAllDay(event):
-                    draw.text((750,(236 + idx * 19)), "cały dzień", font=FONT_LATO, anchor="ma")
-                else:
-                    draw.text((750,(236 + idx * 19)), f'{event["begin"].format("HH:mm")} - {event["end"].format("HH:mm")}', font=FONT_LATO, anchor="ma")
-
-        #Next 5 days
-        draw.text((205, 345), "Następne 5 dni", font=FONT_LATO_BOLD)
-        if nextDaysEvents:
-            for idx, event in enumerate(nextDaysEvents):
-                draw.text((205,(379 + idx * 19)), event['title'], font=FONT_LATO)
-                draw.text((600,(379 + idx * 19)), event['owner'], font=FONT_LATO, anchor="ma")
-                draw.text((650,(379 + idx * 19)), event['begin'].format("DD.MM"), font=FONT_LATO)
-                if calendar.CalendarModule.isEventAllDay(event):
-                    draw.text((750,(379 + idx * 19)), "cały dzień", font=FONT_LATO, anchor="ma")
-                else:
-                    draw.text((750,(379 + idx * 19)), f'{event["begin"].format("HH:mm")} - {event["end"].format("HH:mm")}', font=FONT_LATO, anchor="ma")
-        logger.info(f'Rendered image size: {image.size}')
-        return image
-
-    def testImage(self, todayEvents, tomorrowEvents, nextDaysEvents, weatherData):
-        logger.info('Start of rendering test image.')
-        today = arrow.utcnow().format('dddd DD. MMMM YYYY', locale=self.locale)
-        image = Image.new('1', (800,480), 255)
-        draw = ImageDraw.Draw(image)
-
-        # Lines
-        draw.line([(200,0),(200,480)], fill="Black", width=2)
-        draw.line([(200,60),(800,60)], fill="Black", width=2)
-        draw.line([(200,200),(800,200)], fill="Black", width=1)
-        draw.line([(200,340),(800,340)], fill="Black", width=1)
-
-        # Weather
-        statusIcon = openPngSize(statusImageNameDict[weatherData["weatherStatus"]], 150, 150)
-        draw.bitmap((25,30), statusIcon)
-
-        draw.text((100,200), f'{weatherData["cityName"]}', font=FONT_LATO_BOLD, anchor="ma")
-
-        FONT_LATO_BOLD.size = 32
-
-        draw.bitmap((40, 250), temperatureIcon)
-        draw.text((65, 250), f'{weatherData["temperature"]} {DEGREE_SIGN}C', font=FONT_LATO_BOLD)
-
-        draw.bitmap((40, 285), dropletIcon)
-        draw.text((65, 285), f'{weatherData["humidity"]} %', font=FONT_LATO_BOLD)
-
-        draw.bitmap((35, 320), pressureIcon)
-        draw.text((65, 320), f'{weatherData["pressure"]} hPa', font=FONT_LATO_BOLD)
-
-        draw.bitmap((35,355), windIcon)
-        draw.text((65,355), f'{weatherData["windSpeed"]} m/s', font=FONT_LATO_BOLD)
+class DateWidget(Widget):
+    """
+    Header with the formatted date, centered in the box.
+    """
+
+    def draw(self, draw, today):
+        self.drawText(draw, (self.size[0] // 2, self.size[1] // 2), f'{today}', FONT_ROBOTO_SERIF, anchor="mm")
+
+class EventListWidget(Widget):
+    """
+    Titled list of events. Columns are x positions of the event parts in the box: title, owner and time, and date
+    when set. Owner and time are centered on their position.
+    """
+
+    def __init__(self, name, box, title, rowsTop, columns, linePitch=19):
+        super().__init__(name, box)
+        self.title = title
+        self.rowsTop = rowsTop
+        self.columns = columns
+        self.linePitch = linePitch
+
+    def getKey(self, events):
+        return [(event.title, event.owner, event.begin, event.end, event.allDay) for event in events or []]
+
+    def draw(self, draw, events):
+        self.drawText(draw, (self.columns["title"], 5), self.title, FONT_LATO_BOLD)
+        for idx, event in enumerate(events or []):
+            y = self.rowsTop + idx * self.linePitch
+            self.drawText(draw, (self.columns["title"], y), event.title, FONT_LATO)
+            self.drawText(draw, (self.columns["owner"], y), event.owner, FONT_LATO, anchor="ma")
+            if "date" in self.columns:
+                self.drawText(draw, (self.columns["date"], y), event.begin.format("DD.MM"), FONT_LATO)
+            if event.allDay:
+                self.drawText(draw, (self.columns["time"], y), "cały dzień", FONT_LATO, anchor="ma")
+            else:
+                self.drawText(draw, (self.columns["time"], y), f'{event.begin.format("HH:mm")} - {event.end.format("HH:mm")}', FONT_LATO, anchor="ma")
+
+def dashboardLayout(textCacheSize=256):
+    return Layout((800, 480), [
+        LinesWidget('lines', (0, 0, 800, 480)),
+        WeatherWidget('weather', (0, 0, 200, 480)),
+        DateWidget('date', (200, 0, 800, 60)),
+        EventListWidget('todayEvents', (200, 60, 800, 200), "Dzisiaj", 37, {"title": 5, "owner": 450, "time": 550}),
+        EventListWidget('tomorrowEvents', (200, 200, 800, 340), "Jutro", 36, {"title": 5, "owner": 450, "time": 550}),
+        EventListWidget('nextDaysEvents', (200, 340, 800, 480), "Następne 5 dni", 39,
+                        {"title": 5, "owner": 400, "date": 450, "time": 550})
+    ], textCacheSize)
 
-        FONT_LATO_BOLD.size = 22
+class ImageModule:
 
-        arrowIcn = arrowIcon.rotate(angle=(180 - weatherData["windDirection"]))
-        draw.bitmap((75, 385), arrowIcn)
+    def __init__(self, config):
+        self.locale = config["locale"]
+        iconAtlasPath = config.get("icon-atlas") or ICON_ATLAS_PATH
+        if config.get("icon-atlas") or os.path.exists(iconAtlasPath):
+            loadIconAtlas(iconAtlasPath)
+        # Optional copy of every rendered frame for debugging, saved on a worker so rendering does not wait for disk.
+        self.debugSnapshot = config.get("debug-snapshot", False)
+        self.debugSnapshotFormat = config.get("debug-snapshot-format", "BMP").upper()
+        self.debugSnapshotPath = config.get("debug-snapshot-path") or os.path.join(SNAPSHOTS_PATH, f'test.{self.debugSnapshotFormat.lower()}')
+        self.executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot') if self.debugSnapshot else None
+        self.layout = dashboardLayout(config.get("text-cache-size", 256))
+        return
 
-        # Date
-        draw.text((500,30), f'{today}', font=FONT_ROBOTO_SERIF, anchor="mm")
-
-        #Today
-        draw.text((205,65), "Dzisiaj", font=FONT_LATO_BOLD)
-        if todayEvents:
-            for idx, event in enumerate(todayEvents):
-                draw.text((205,(97 + idx * 19)), event['title'], font=FONT_LATO)
-                draw.text((650,(97 + idx * 19)), event['owner'], font=FONT_LATO, anchor="ma")
-                if calendar.CalendarModule.isEventAllDay(event):
-                    draw.text((750,(97 + idx * 19)), "cały dzień", font=FONT_LATO, anchor="ma")
-                else:
-                    draw.text((750,(97 + idx * 19)), f'{event["begin"].format("HH:mm")} - {event["end"].format("HH:mm")}', font=FONT_LATO, anchor="ma")
-
-        #Tomorrow
-        draw.text((205, 205), "Jutro", font=FONT_LATO_BOLD)
-        if tomorrowEvents:
-            for idx, event in enumerate(tomorrowEvents):
-                draw.text((205,(236 + idx * 19)), event['title'], font=FONT_LATO)
-                draw.text((650,(236 + idx * 19)), event['owner'], font=FONT_LATO, anchor="ma")
-                if calendar.CalendarModule.isEventAllDay(event):
-                    draw.text((750,(236 + idx * 19)), "cały dzień", font=FONT_LATO, anchor="ma")
-                else:
-                    draw.text((750,(236 + idx * 19)), f'{event["begin"].format("HH:mm")} - {event["end"].format("HH:mm")}', font=FONT_LATO, anchor="ma")
-
-        #Next 5 days
-        draw.text((205, 345), "Następne 5 dni", font=FONT_LATO_BOLD)
-        if nextDaysEvents:
-            for idx, event in enumerate(nextDaysEvents):
-                draw.text((205,(379 + idx * 19)), event['title'], font=FONT_LATO)
-                draw.text((600,(379 + idx * 19)), event['owner'], font=FONT_LATO, anchor="ma")
-                draw.text((650,(379 + idx * 19)), event['begin'].format("DD.MM"), font=FONT_LATO)
-                if calendar.CalendarModule.isEventAllDay(event):
-                    draw.text((750,(379 + idx * 19)), "cały dzień", font=FONT_LATO, anchor="ma")
-                else:
-                    draw.text((750,(379 + idx * 19)), f'{event["begin"].format("HH:mm")} - {event["end"].format("HH:mm")}', font=FONT_LATO, anchor="ma")
-            logger.info(f'Rendered image size: {image.size}')
-            image.save(testFile)
+    def renderDashboardImage(self, todayEvents, tomorrowEvents, nextDaysEvents, weatherData):
+        """
+        Renders the dashboard frame. Only widgets whose data changed since the previous frame are drawn again.
+        Returns the frame and the boxes (x0, y0, x1, y1) of those widgets, ends exclusive and x aligned to 8 pixels.
+        Nothing outside of the boxes differs from the previous frame.
+        """
+        logger.info('Start of rendering dashboard image.')
+        today = arrow.utcnow().format('dddd DD. MMMM YYYY', locale=self.locale)
+        image = self.layout.render({
+            'weather': weatherData,
+            'date': today,
+            'todayEvents': todayEvents,
+            'tomorrowEvents': tomorrowEvents,
+            'nextDaysEvents': nextDaysEvents
+        })
+        logger.info(f'Rendered image size: {image.size}')
+        if self.debugSnapshot:
+            self.executor.submit(self.__saveSnapshot, image.copy())
+        return image, self.layout.dirtyBoxes
+
+    def __saveSnapshot(self, image):
+        try:
+            image.save(self.debugSnapshotPath, format=self.debugSnapshotFormat)
+            logger.info(f'Debug snapshot saved to {self.debugSnapshotPath}.')
+        except (OSError, ValueError, KeyError) as ex:
+            logger.error(f'Cannot save debug snapshot: {ex}')
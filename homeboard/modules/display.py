@@ -1,23 +1,165 @@
 import logging
-from waveshare_epd import epd7in5_V2
+import time
+from concurrent import futures
+from datetime import datetime
+from waveshare_epd import epd7in5_V2, epdbuffer, epdconfig
 
 logger = logging.getLogger(__name__)
 
+class RefreshPolicy:
+    """
+    Decides whether the panel is fully cleared before a refresh. Modes:
+    never - single refresh every time (default),
+    always - clear before every refresh,
+    every - clear before every clear-every-th refresh, starting with the first one,
+    schedule - clear before the first refresh within each of clear-hours (local time), an unchanged frame
+    is refreshed too when its clear is due.
+    Only frames sent to the panel count as refreshes, unchanged frames that are skipped do not.
+    """
+
+    MODES = ('never', 'always', 'every', 'schedule')
+
+    def __init__(self, config):
+        self.mode = config.get("clear-mode", "never")
+        if self.mode not in RefreshPolicy.MODES:
+            logger.warning(f'Unknown clear-mode {self.mode}, panel will not be cleared.')
+            self.mode = 'never'
+        self.clearEvery = max(config.get("clear-every", 10), 1)
+        self.clearHours = set(config.get("clear-hours", []))
+        self.refreshCount = 0
+        self.lastScheduledClear = None
+
+    def shouldClear(self, now=None):
+        """
+        Called once for every refresh that is sent to the panel, counts it and tells whether to clear before it.
+        """
+        self.refreshCount += 1
+        if self.mode == 'always':
+            return True
+        if self.mode == 'every':
+            return (self.refreshCount - 1) % self.clearEvery == 0
+        if self.isScheduledClearDue(now):
+            now = now or datetime.now()
+            self.lastScheduledClear = (now.date(), now.hour)
+            return True
+        return False
+
+    def isScheduledClearDue(self, now=None):
+        # Whether a scheduled clear is waiting within the current hour, without counting a refresh.
+        if self.mode != 'schedule':
+            return False
+        now = now or datetime.now()
+        return now.hour in self.clearHours and (now.date(), now.hour) != self.lastScheduledClear
+
 class DisplayModule:
 
     def __init__(self, config):
         self.config = config
+        epdconfig.configure(config.get("spi-bus"), config.get("spi-device"), config.get("spi-speed"),
+                            config.get("busy-timeout"))
+        self.display = epd7in5_V2.EPD()
+        self.refreshTimeout = config.get("refresh-timeout", 120)
+        self.refreshPolicy = RefreshPolicy(config)
+        self.partialRefresh = config.get("partial-refresh", True) and getattr(self.display, 'PARTIAL_REFRESH', False)
+        self.fullRefreshEvery = config.get("full-refresh-every", 10)
+        self.partialCount = 0
+        # Frame the panel will show once the queued refreshes are done.
+        self.lastFrame = None
+        # A single worker owns the SPI bus, so refreshes never overlap and run in submission order.
+        self.executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='display')
+        self.pendingRefresh = None
+        # Set by the display worker when a refresh fails. Refreshes queued behind it were planned as partial
+        # updates of a frame the panel may not show, so they are done as full refreshes until one succeeds.
+        self.refreshFailed = False
 
-    @staticmethod
-    def displayImage(image):
-        logger.info("Displaying image on 7,5\" e-paper display.")
+    def displayImage(self, image, dirtyBoxes=None):
+        """
+        Packs the image and hands it to the display worker. Returns a Future that completes once the panel
+        has been refreshed and put to sleep, so the caller can fetch and render the next frame meanwhile.
+        Only the changed part of the frame is refreshed when the panel supports partial refresh, with a full
+        refresh after every full-refresh-every partial ones to clear ghosting. Unchanged frames are skipped.
+        dirtyBoxes are the parts of the image that may differ from the previous one, only they are compared.
+        """
+        if self.pendingRefresh and not self.pendingRefresh.done():
+            logger.warning('Previous display refresh still running, queueing the new image behind it.')
+        buffer = self.display.getbuffer(image)
+        previous = self.lastFrame
+        now = datetime.now()
+        region = None
+        if previous is not None:
+            if image.size != (self.display.width, self.display.height):
+                # the image is rotated to fit the panel, so the boxes do not apply
+                dirtyBoxes = None
+            region = epdbuffer.changed_region(previous, buffer, self.display.width, self.display.height, dirtyBoxes)
+            # skipped frames are not refreshes, so they are not counted by the refresh policy
+            if region is None and not self.refreshPolicy.isScheduledClearDue(now):
+                logger.info('Frame unchanged, skipping display refresh.')
+                return self.pendingRefresh
+        clear = self.refreshPolicy.shouldClear(now)
+        if clear or not self.partialRefresh or self.partialCount >= self.fullRefreshEvery:
+            region = None
+        self.partialCount = self.partialCount + 1 if region else 0
+        self.lastFrame = buffer
+        self.pendingRefresh = self.executor.submit(self.__refresh, buffer, clear, region, previous)
+        self.pendingRefresh.add_done_callback(self.__reportRefresh)
+        return self.pendingRefresh
+
+    def waitForRefresh(self, timeout=None):
+        """
+        Blocks until the last queued refresh has finished. Returns False when it did not finish within timeout
+        seconds (refresh-timeout from the display configuration by default) or failed.
+        """
+        if not self.pendingRefresh:
+            return True
+        if timeout is None:
+            timeout = self.refreshTimeout
         try:
-            display = epd7in5_V2.EPD()
-            display.init()
-            logger.info("Display initialized.")
-            display.Clear()
-            display.display(display.getbuffer(image))
+            self.pendingRefresh.result(timeout)
+            return True
+        except Exception:
+            # failed refreshes are reported by __reportRefresh
+            if not self.pendingRefresh.done():
+                logger.error(f'Display refresh did not finish within {timeout}s.')
+        return False
+
+    def __refresh(self, buffer, clear, region, previous):
+        if region and self.refreshFailed:
+            logger.warning('Previous display refresh failed, doing a full refresh instead of a partial one.')
+            region = None
+        try:
+            self.__refreshPanel(buffer, clear, region, previous)
+        except Exception:
+            self.refreshFailed = True
+            raise
+        if not region:
+            # the panel shows a whole known frame again
+            self.refreshFailed = False
+
+    def __refreshPanel(self, buffer, clear, region, previous):
+        startTime = time.time()
+        display = self.display
+        if region:
+            logger.info(f'Partially refreshing 7,5" e-paper display in {region}.')
+            display.update_region(buffer, *region, old=previous)
             display.sleep()
+            logger.info(f'Display partially refreshed. Took {(time.time() - startTime):.2f}s.')
+            return
+        logger.info("Displaying image on 7,5\" e-paper display.")
+        display.init()
+        logger.info("Display initialized.")
+        if clear:
+            logger.info("Clearing display.")
+            display.Clear()
+        display.display(buffer)
+        display.sleep()
+        logger.info(f'Display refreshed. Took {(time.time() - startTime):.2f}s.')
 
-        except IOError as e:
-            logger.error(e)
+    def __reportRefresh(self, refresh):
+        if refresh.cancelled():
+            return
+        error = refresh.exception()
+        if error:
+            logger.error(f'Display refresh failed: {error}')
+            # the panel content is unknown now, next frame gets a full refresh, frames already queued are
+            # refreshed fully by the worker
+            self.lastFrame = None
@@ -0,0 +1,120 @@
+import collections
+import logging
+from PIL import Image, ImageChops, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+class TextCache:
+    """
+    Bounded LRU cache of rasterized text runs keyed by (text, font, size, anchor). A run is drawn once with
+    ImageDraw.text into a mask around its bounding box, later draws stamp the mask, which gives the same pixels
+    without shaping and rasterizing the text again.
+    """
+
+    # pixels kept around the bounding box reported by the font
+    MARGIN = 2
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.runs = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def getRun(self, text, font, anchor=None):
+        """
+        Returns the mask of the text run and the offset of its top left corner from the anchor point.
+        """
+        key = (text, font, font.size, anchor)
+        run = self.runs.get(key)
+        if run:
+            self.hits += 1
+            self.runs.move_to_end(key)
+            return run
+        self.misses += 1
+        left, top, right, bottom = font.getbbox(text, mode='1', anchor=anchor)
+        left, top = int(left) - TextCache.MARGIN, int(top) - TextCache.MARGIN
+        mask = Image.new('1', (int(right) + TextCache.MARGIN - left, int(bottom) + TextCache.MARGIN - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font, anchor=anchor)
+        run = (mask, (left, top))
+        self.runs[key] = run
+        if len(self.runs) > self.maxsize:
+            self.runs.popitem(last=False)
+        return run
+
+    def drawText(self, draw, xy, text, font, anchor=None):
+        # Same as draw.text(xy, text, font=font, anchor=anchor) for single line text at whole pixel positions.
+        mask, (left, top) = self.getRun(text, font, anchor)
+        draw.bitmap((xy[0] + left, xy[1] + top), mask)
+
+class Widget:
+    """
+    Rectangular part of a layout. A widget draws its data into its own image of the size of its box, in box
+    coordinates. The image is kept and reused until the widget gets different data.
+    """
+
+    def __init__(self, name, box):
+        self.name = name
+        # (left, top, right, bottom) in the frame, right and bottom exclusive
+        self.box = box
+        self.key = None
+        self.image = None
+        # set by the layout the widget is part of
+        self.textCache = TextCache()
+
+    @property
+    def size(self):
+        return (self.box[2] - self.box[0], self.box[3] - self.box[1])
+
+    def getKey(self, data):
+        # Value compared between renders to tell whether data changed, data itself by default.
+        return data
+
+    def draw(self, draw, data):
+        raise NotImplementedError
+
+    def drawText(self, draw, xy, text, font, anchor=None):
+        self.textCache.drawText(draw, xy, text, font, anchor)
+
+    def render(self, data):
+        """
+        Redraws the widget image when data changed since the last render. Returns whether it was redrawn.
+        """
+        key = self.getKey(data)
+        if self.image is not None and key == self.key:
+            return False
+        image = Image.new('1', self.size, 255)
+        self.draw(ImageDraw.Draw(image), data)
+        self.image = image
+        self.key = key
+        return True
+
+class Layout:
+    """
+    Frame of the given size composed of widgets. Widgets get their data by name and are composited in order,
+    black pixels of every widget are kept, so widgets may overlap.
+    """
+
+    def __init__(self, size, widgets, textCacheSize=256):
+        self.size = size
+        self.widgets = widgets
+        # one text cache for all widgets, as they share fonts and often strings
+        self.textCache = TextCache(textCacheSize)
+        for widget in widgets:
+            widget.textCache = self.textCache
+        # widgets redrawn by the last render and their boxes, rounded out to whole bytes of the frame
+        self.changedWidgets = []
+        self.dirtyBoxes = []
+
+    def render(self, data):
+        frame = Image.new('1', self.size, 255)
+        self.changedWidgets = []
+        for widget in self.widgets:
+            if widget.render(data.get(widget.name)):
+                self.changedWidgets.append(widget)
+            frame.paste(ImageChops.logical_and(frame.crop(widget.box), widget.image), widget.box)
+        byteWidth = (self.size[0] + 7) // 8 * 8
+        self.dirtyBoxes = [(widget.box[0] // 8 * 8, widget.box[1], min((widget.box[2] + 7) // 8 * 8, byteWidth), widget.box[3])
+                           for widget in self.changedWidgets]
+        logger.info(f'Layout rendered, redrawn widgets: {", ".join(widget.name for widget in self.changedWidgets) or "none"}. '
+                    f'Text cache: {self.textCache.hits} hits, {self.textCache.misses} misses.')
+        return frame
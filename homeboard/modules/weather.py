@@ -1,11 +1,15 @@
 import logging
+import os
 import requests
 import json
 import time
+from concurrent import futures
 from requests.exceptions import HTTPError
 
 logger = logging.getLogger(__name__)
 
+projectPath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
 class WeatherModule:
 
     def __init__(self, config):
@@ -14,8 +18,42 @@ class WeatherModule:
         self.lang = config["lang"]
         self.units = config["units"]
         self.cityName = config["city-name"]
+        self.cacheTtl = config.get("cache-ttl", 600)
+        self.cacheFile = os.path.join(config.get("cache-path") or f'{projectPath}/cache', 'weather.json')
+        self.executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='weather')
+        self.pendingRefresh = None
+        self.cached = self.__loadCache()
 
     def getWeatherData(self):
+        """
+        Returns weather data younger than cache-ttl seconds from the cache. Older data is returned right away too,
+        while a fresh response is requested in the background. Only without any cached data the API is called
+        synchronously. Cached data is kept when the API call fails, so a failed call returns stale data.
+        """
+        cached = self.cached
+        if not cached:
+            return self.__refreshWeatherData()
+        age = time.time() - cached["fetched"]
+        if age >= self.cacheTtl:
+            if self.pendingRefresh and not self.pendingRefresh.done():
+                logger.info('Weather data is already being refreshed.')
+            else:
+                logger.info(f'Weather data is {age:.0f}s old, refreshing it in the background.')
+                self.pendingRefresh = self.executor.submit(self.__refreshWeatherData)
+        return cached["weather"]
+
+    def __refreshWeatherData(self):
+        weatherData = self.__fetchWeatherData()
+        if not weatherData:
+            if self.cached:
+                logger.warning('Weather API call failed, using cached weather data.')
+                return self.cached["weather"]
+            return None
+        self.cached = {"fetched": time.time(), "weather": weatherData}
+        self.__storeCache(self.cached)
+        return weatherData
+
+    def __fetchWeatherData(self):
         finalUrl = f'{self.url}?appid={self.apiKey}&q={self.cityName}'
         if self.lang:
             finalUrl = f'{finalUrl}&lang={self.lang}'
@@ -29,17 +67,39 @@ class WeatherModule:
             endTime = time.time()
             logger.info(f'Weather API call executed. Took {(endTime - startTime):.2f}s.')
             jsonResponse = response.json()
+            if jsonResponse:
+                return {
+                    'cityName': jsonResponse["name"],
+                    'temperature': jsonResponse["main"]["temp"],
+                    'pressure': jsonResponse["main"]["pressure"],
+                    'humidity': jsonResponse["main"]["humidity"],
+                    'windSpeed': jsonResponse["wind"]["speed"],
+                    'windDirection': jsonResponse["wind"]["deg"],
+                    'weatherStatus': jsonResponse["weather"][0]["icon"]
+                }
         except HTTPError as httpError:
             logger.error(f'HTTP error occurred: {httpError}')
         except Exception as ex:
             logger.error(f'Exception occurred: {ex}')
-        if jsonResponse:
-            return {
-                'cityName': jsonResponse["name"],
-                'temperature': jsonResponse["main"]["temp"],
-                'pressure': jsonResponse["main"]["pressure"],
-                'humidity': jsonResponse["main"]["humidity"],
-                'windSpeed': jsonResponse["wind"]["speed"],
-                'windDirection': jsonResponse["wind"]["deg"],
-                'weatherStatus': jsonResponse["weather"][0]["icon"]
-            }
+        return None
+
+    def __loadCache(self):
+        try:
+            with open(self.cacheFile) as cacheFile:
+                cached = json.load(cacheFile)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cached, dict) or not cached.get("weather") or "fetched" not in cached:
+            return None
+        logger.info(f'Loaded weather data from cache.')
+        return cached
+
+    def __storeCache(self, cached):
+        # written to a temporary file first, so a crash never leaves a half written cache behind
+        try:
+            os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+            with open(f'{self.cacheFile}.tmp', 'w') as cacheFile:
+                json.dump(cached, cacheFile)
+            os.replace(f'{self.cacheFile}.tmp', self.cacheFile)
+        except OSError as ex:
+            logger.warning(f'Cannot store weather data in cache: {ex}')
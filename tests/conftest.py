@@ -0,0 +1,55 @@
+import importlib
+import os
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def board_stand_ins():
+    """
+    Replaces epdconfig and RPi.GPIO with stand-ins for the whole session, so drivers and homeboard modules can be
+    imported without the GPIO and SPI libraries of the board. The stand-ins answer 0 for any attribute.
+    """
+    import waveshare_epd
+    config = types.ModuleType('waveshare_epd.epdconfig')
+    config.__getattr__ = lambda name: 0
+    gpio = types.ModuleType('RPi.GPIO')
+    gpio.__getattr__ = lambda name: 0
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    stand_ins = {'waveshare_epd.epdconfig': config, 'RPi': rpi, 'RPi.GPIO': gpio}
+    replaced = lambda name: name.startswith(('waveshare_epd.', 'homeboard')) or name in stand_ins
+    saved = {name: module for name, module in sys.modules.items() if replaced(name)}
+    saved_config = getattr(waveshare_epd, 'epdconfig', None)
+    for name in saved:
+        del sys.modules[name]
+    sys.modules.update(stand_ins)
+    waveshare_epd.epdconfig = config
+    yield config
+    for name in [name for name in sys.modules if replaced(name)]:
+        del sys.modules[name]
+    sys.modules.update(saved)
+    if saved_config is None:
+        del waveshare_epd.epdconfig
+    else:
+        waveshare_epd.epdconfig = saved_config
+
+
+@pytest.fixture(scope='module')
+def epd_module(board_stand_ins):
+    """
+    Imports waveshare_epd driver modules against the board stand-ins, so drivers can be created and their
+    buffers checked.
+    """
+    return lambda name: importlib.import_module('waveshare_epd.' + name)
+
+
+@pytest.fixture(scope='module')
+def homeboard_module(board_stand_ins):
+    """
+    Imports homeboard modules against the board stand-ins. Importing homeboard sets up its logging.
+    """
+    return lambda name: importlib.import_module('homeboard.modules.' + name)
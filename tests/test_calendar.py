@@ -0,0 +1,227 @@
+import datetime
+import hashlib
+import http.server
+import pickle
+import random
+import threading
+import arrow
+import pytest
+import recurring_ical_events
+from icalendar import Calendar
+
+# Fixed "now", a week spanning the end of daylight saving time in Europe (25.10) and in the US (1.11).
+NOW = arrow.get(2026, 10, 24, 22, 30)
+TIMEZONES = ['Europe/Warsaw', 'America/New_York', 'Asia/Tokyo', 'UTC']
+
+
+def feed(seed, count=200):
+    """
+    iCalendar feed of random events around NOW: all-day spans, floating, UTC and TZID times, zero length and
+    overnight events, some of them recurring.
+    """
+    rand = random.Random(seed)
+    today = NOW.date()
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//home-board//tests//EN']
+    for i in range(count):
+        day = today + datetime.timedelta(days=rand.randint(-20, 12))
+        lines += ['BEGIN:VEVENT', f'UID:{seed}-{i}', f'SUMMARY: Event {seed}-{i}']
+        if rand.random() < 0.25:
+            end = day + datetime.timedelta(days=rand.randint(1, 3))
+            lines += [f'DTSTART;VALUE=DATE:{day:%Y%m%d}', f'DTEND;VALUE=DATE:{end:%Y%m%d}']
+        else:
+            start = datetime.datetime.combine(day, datetime.time(rand.randint(0, 23), rand.choice([0, 0, 30])))
+            end = start + datetime.timedelta(minutes=rand.choice([0, 30, 60, 180, 1500]))
+            timezone = rand.choice(['Europe/Warsaw', 'America/New_York', 'Asia/Tokyo', None, 'UTC'])
+            if timezone is None:
+                lines += [f'DTSTART:{start:%Y%m%dT%H%M%S}', f'DTEND:{end:%Y%m%dT%H%M%S}']
+            elif timezone == 'UTC':
+                lines += [f'DTSTART:{start:%Y%m%dT%H%M%SZ}', f'DTEND:{end:%Y%m%dT%H%M%SZ}']
+            else:
+                lines += [f'DTSTART;TZID={timezone}:{start:%Y%m%dT%H%M%S}', f'DTEND;TZID={timezone}:{end:%Y%m%dT%H%M%S}']
+        if rand.random() < 0.4:
+            lines.append(rand.choice(['RRULE:FREQ=DAILY', 'RRULE:FREQ=WEEKLY', 'RRULE:FREQ=DAILY;INTERVAL=3',
+                                      'RRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR']))
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(lines) + '\r\n').encode()
+
+
+class FeedServer(http.server.ThreadingHTTPServer):
+    """
+    Serves feeds by path with an ETag. A request waits while gate is cleared, status makes every request fail.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FeedHandler)
+        self.feeds = {}
+        self.status = 200
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.gate.wait()
+        body = self.server.feeds.get(self.path)
+        if self.server.status != 200 or body is None:
+            self.send_response(self.server.status if self.server.status != 200 else 404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = FeedServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.gate.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def calendar(homeboard_module, monkeypatch):
+    monkeypatch.setattr(arrow, 'utcnow', lambda: NOW)
+    return homeboard_module('calendar')
+
+
+def module(calendar, server, tmp_path, timezone='Europe/Warsaw'):
+    return calendar.CalendarModule({
+        'icalendars': [['Ala', server.url('/ala.ics')], ['Ola', server.url('/ola.ics')]],
+        'timezone': timezone,
+        'cache-path': str(tmp_path),
+        'max-age': 0,
+        'fetch-timeout': 5,
+        'fetch-deadline': 10
+    })
+
+
+def baseline_events(calendars, timezone, days, length, count):
+    # The event lists as the module built them before the event index: every calendar expanded for the span,
+    # converted and sorted by begin.
+    start = arrow.get(NOW.shift(days=days).date())
+    fmt = lambda date: (date.year, date.month, date.day, date.hour, date.minute, date.second)
+    t_start, t_end = fmt(start), fmt(start.shift(days=length))
+    events = []
+    for name, body in calendars:
+        for event in recurring_ical_events.of(Calendar.from_ical(body)).between(t_start, t_end):
+            begin, end = arrow.get(event.get('DTSTART').dt), arrow.get(event.get('DTEND').dt)
+            if begin.format('HH:mm') != '00:00':
+                begin, end = begin.to(timezone), end.to(timezone)
+            else:
+                begin, end = begin.replace(tzinfo=timezone), end.replace(tzinfo=timezone)
+            events.append((event.get('SUMMARY').lstrip(), begin.isoformat(), end.isoformat(), name))
+    events.sort(key=lambda event: arrow.get(event[1]))
+    return events[0:count] or None
+
+
+def event_lists(calendar_module, count):
+    lists = (calendar_module.getTodaysEvents(count), calendar_module.getTomorrowsEvents(count),
+             calendar_module.getEventsForFiveDays(count))
+    return [[(event.title, event.begin.isoformat(), event.end.isoformat(), event.owner) for event in events]
+            if events else None for events in lists]
+
+
+def baseline_lists(server, timezone, count):
+    calendars = [('Ala', server.feeds['/ala.ics']), ('Ola', server.feeds['/ola.ics'])]
+    return [baseline_events(calendars, timezone, days, length, count) for days, length in ((0, 1), (1, 1), (2, 6))]
+
+
+@pytest.mark.parametrize('timezone', TIMEZONES)
+def test_event_lists_match_baseline(calendar, server, tmp_path, timezone):
+    server.feeds = {'/ala.ics': feed(1), '/ola.ics': feed(2)}
+    calendar_module = module(calendar, server, tmp_path, timezone)
+    for count in (5, 1000):
+        assert event_lists(calendar_module, count) == baseline_lists(server, timezone, count)
+
+
+@pytest.mark.parametrize('timezone', TIMEZONES)
+def test_event_lists_from_snapshot_match_baseline(calendar, server, tmp_path, timezone):
+    server.feeds = {'/ala.ics': feed(3), '/ola.ics': feed(4)}
+    module(calendar, server, tmp_path, timezone).getTodaysEvents()
+    # restarted with the server down, the snapshots and the cached feeds are used
+    server.status = 500
+    calendar_module = module(calendar, server, tmp_path, timezone)
+    for pending_fetch in calendar_module.pendingFetches.values():
+        pending_fetch.result(10)
+    assert event_lists(calendar_module, 1000) == baseline_lists(server, timezone, 1000)
+
+
+def test_index_covers_a_week_from_its_day(calendar):
+    day = arrow.get(NOW.date())
+    index = calendar.EventIndex('feed', day, 'UTC', [], [])
+    assert index.covers(day)
+    assert index.covers(day.shift(days=calendar.EventIndex.DAYS - 8))
+    assert not index.covers(day.shift(days=calendar.EventIndex.DAYS - 7))
+    assert not index.covers(day.shift(days=-1))
+
+
+def test_index_snapshot_round_trip(calendar, server, tmp_path):
+    server.feeds = {'/ala.ics': feed(5), '/ola.ics': feed(6)}
+    calendar_module = module(calendar, server, tmp_path, 'America/New_York')
+    calendar_module.getTodaysEvents()
+    t_start, t_end = datetime.datetime(2026, 10, 24), datetime.datetime(2026, 11, 2)
+    for index in calendar_module.eventIndexes.values():
+        snapshot = pickle.loads(pickle.dumps(index.getSnapshot()))
+        loaded = calendar.EventIndex.fromSnapshot(snapshot, 'America/New_York')
+        assert (loaded.feed, loaded.day, loaded.spans) == (index.feed, index.day, index.spans)
+        assert [repr(event) for event in loaded.between(t_start, t_end)] == [repr(event) for event in index.between(t_start, t_end)]
+        assert [event.allDay for event in loaded.events] == [event.allDay for event in index.events]
+        assert calendar.EventIndex.fromSnapshot(snapshot, 'Europe/Warsaw') is None
+        assert calendar.EventIndex.fromSnapshot(dict(snapshot, version=0), 'America/New_York') is None
+
+
+def single_event_feed(summary):
+    return ('\r\n'.join(['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//home-board//tests//EN', 'BEGIN:VEVENT', 'UID:single',
+                         f'SUMMARY:{summary}', f'DTSTART:{NOW:YYYYMMDD}T100000Z', f'DTEND:{NOW:YYYYMMDD}T110000Z',
+                         'END:VEVENT', 'END:VCALENDAR']) + '\r\n').encode()
+
+
+def today_titles(calendar_module):
+    return [event.title for event in calendar_module.getTodaysEvents() or []]
+
+
+def wait_for_fetches(calendar_module):
+    for pending_fetch in calendar_module.pendingFetches.values():
+        pending_fetch.result(10)
+
+
+def test_fetched_feed_updates_snapshot_without_render(calendar, server, tmp_path):
+    server.feeds = {'/ala.ics': single_event_feed('Old event'), '/ola.ics': single_event_feed('Other event')}
+    assert today_titles(module(calendar, server, tmp_path)) == ['Old event', 'Other event']
+    server.feeds['/ala.ics'] = single_event_feed('New event')
+    # a one-shot run renders from the snapshots while the feeds are still being fetched
+    server.gate.clear()
+    calendar_module = module(calendar, server, tmp_path)
+    assert today_titles(calendar_module) == ['Old event', 'Other event']
+    server.gate.set()
+    wait_for_fetches(calendar_module)
+    # the next run starts from a snapshot of the new feed, before its own fetch finishes
+    server.gate.clear()
+    calendar_module = module(calendar, server, tmp_path)
+    assert today_titles(calendar_module) == ['New event', 'Other event']
+    server.gate.set()
+    wait_for_fetches(calendar_module)
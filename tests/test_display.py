@@ -0,0 +1,149 @@
+import threading
+import pytest
+from PIL import Image
+from waveshare_epd import epdbuffer
+
+WIDTH, HEIGHT = 80, 16
+
+
+def frame(*black):
+    image = Image.new('1', (WIDTH, HEIGHT), 255)
+    for xy in black:
+        image.putpixel(xy, 0)
+    return image
+
+
+def packed(*black, width=WIDTH, height=HEIGHT):
+    image = Image.new('1', (width, height), 255)
+    for xy in black:
+        image.putpixel(xy, 0)
+    return epdbuffer.pack_1bpp(image, width, height)
+
+
+def test_changed_region_unchanged():
+    assert epdbuffer.changed_region(packed((3, 3)), packed((3, 3)), WIDTH, HEIGHT) is None
+
+
+def test_changed_region_rounds_x_to_bytes():
+    assert epdbuffer.changed_region(packed(), packed((13, 5)), WIDTH, HEIGHT) == (8, 5, 16, 6)
+
+
+def test_changed_region_pads_last_byte():
+    old, new = packed(width=122, height=4), packed((121, 2), width=122, height=4)
+    assert epdbuffer.changed_region(old, new, 122, 4) == (120, 2, 128, 3)
+
+
+def test_changed_region_merges_changes():
+    assert epdbuffer.changed_region(packed(), packed((13, 5), (40, 2), (70, 9)), WIDTH, HEIGHT) == (8, 2, 72, 10)
+
+
+def test_changed_region_only_compares_boxes():
+    old, new = packed(), packed((21, 3), (25, 3), (60, 12))
+    # x of the box is rounded out to bytes 0-2, so x=21 is compared and x=25 is not
+    assert epdbuffer.changed_region(old, new, WIDTH, HEIGHT, [(3, 0, 20, 8)]) == (16, 3, 24, 4)
+    assert epdbuffer.changed_region(old, new, WIDTH, HEIGHT, [(0, 0, 8, 16)]) is None
+    assert epdbuffer.changed_region(old, new, WIDTH, HEIGHT, [(3, 0, 20, 8), (56, 10, 64, 16)]) == (16, 3, 64, 13)
+
+
+class FakeEPD:
+    """
+    Panel recording the refreshes it gets. A refresh blocks until gate is set, update_region fails for the
+    frames in failing.
+    """
+
+    PARTIAL_REFRESH = True
+
+    def __init__(self):
+        self.width = WIDTH
+        self.height = HEIGHT
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.failing = []
+
+    def getbuffer(self, image):
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
+
+    def init(self):
+        self.gate.wait()
+
+    def Clear(self):
+        self.calls.append('clear')
+
+    def display(self, buffer):
+        self.calls.append(('full', bytes(buffer)))
+
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.gate.wait()
+        if bytes(buffer) in self.failing:
+            raise RuntimeError('SPI transfer failed')
+        self.calls.append(('partial', bytes(buffer), (x0, y0, x1, y1)))
+
+    def sleep(self):
+        pass
+
+
+@pytest.fixture
+def display_module(homeboard_module, monkeypatch):
+    display = homeboard_module('display')
+    monkeypatch.setattr(display.epdconfig, 'configure', lambda *args: None, raising=False)
+    monkeypatch.setattr(display.epd7in5_V2, 'EPD', FakeEPD)
+    modules = []
+
+    def create(**config):
+        module = display.DisplayModule(config)
+        modules.append(module)
+        return module
+    yield create
+    for module in modules:
+        module.executor.shutdown()
+
+
+def show(module, image):
+    module.displayImage(image)
+    assert module.waitForRefresh(5)
+
+
+def refreshes(module):
+    return [(call[0], call[2]) if call[0] == 'partial' else call[0] for call in module.display.calls]
+
+
+def test_partial_full_and_skipped_refreshes(display_module):
+    module = display_module(**{"full-refresh-every": 2})
+    show(module, frame())
+    show(module, frame())
+    show(module, frame((13, 5)))
+    show(module, frame((13, 5)))
+    show(module, frame((13, 5), (40, 2)))
+    show(module, frame((40, 2)))
+    assert refreshes(module) == ['full', ('partial', (8, 5, 16, 6)), ('partial', (40, 2, 48, 3)), 'full']
+
+
+def test_dirty_boxes_limit_compared_region(display_module):
+    module = display_module()
+    show(module, frame())
+    module.displayImage(frame((13, 5), (70, 9)), [(8, 0, 16, 16)])
+    assert module.waitForRefresh(5)
+    assert refreshes(module) == ['full', ('partial', (8, 5, 16, 6))]
+
+
+def test_failed_refresh_falls_back_to_full_refreshes(display_module):
+    module = display_module(**{"full-refresh-every": 10})
+    show(module, frame())
+    failing = module.display.getbuffer(frame((13, 5)))
+    module.display.failing.append(bytes(failing))
+    # queue frames behind the failing one, they are planned as partial refreshes
+    module.display.gate.clear()
+    module.displayImage(frame((13, 5)))
+    module.displayImage(frame((13, 5), (40, 2)))
+    module.displayImage(frame((13, 5), (40, 2), (70, 9)))
+    module.display.gate.set()
+    module.waitForRefresh(5)
+    assert refreshes(module) == ['full', 'full', ('partial', (64, 9, 72, 10))]
+    assert module.display.calls[1][1] == bytes(module.display.getbuffer(frame((13, 5), (40, 2))))
+    assert not module.refreshFailed
+    # the failure also dropped the last frame, so the next frame is refreshed fully
+    assert module.lastFrame is None
+    show(module, frame((13, 5), (40, 2), (70, 9)))
+    show(module, frame((40, 2), (70, 9)))
+    assert refreshes(module)[3:] == ['full', ('partial', (8, 5, 16, 6))]
@@ -0,0 +1,79 @@
+import http.server
+import json
+import threading
+import time
+import pytest
+
+
+class WeatherHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = json.dumps(self.server.weather).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), WeatherHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def response(temperature):
+    return {'name': 'Kraków', 'main': {'temp': temperature, 'pressure': 1013, 'humidity': 80},
+            'wind': {'speed': 3, 'deg': 180}, 'weather': [{'icon': '01d'}]}
+
+
+class Recorder:
+    """
+    Stands in for the calendar, image and display modules of HomeBoard and records the rendered weather.
+    """
+
+    def __init__(self):
+        self.weather = []
+
+    def getTodaysEvents(self):
+        return None
+
+    getTomorrowsEvents = getEventsForFiveDays = getTodaysEvents
+
+    def renderDashboardImage(self, todayEvents, tomorrowEvents, nextDaysEvents, weatherData):
+        self.weather.append(weatherData["temperature"])
+        return None, []
+
+    def displayImage(self, image, dirtyBoxes=None):
+        pass
+
+
+def test_display_shows_weather_refreshed_in_background(homeboard_module, server, tmp_path):
+    weather = homeboard_module('weather')
+    from homeboard.main import HomeBoard
+    with open(tmp_path / 'weather.json', 'w') as cache_file:
+        json.dump({'fetched': time.time() - 3600, 'weather': dict(
+            cityName='Kraków', temperature=10, pressure=1013, humidity=80, windSpeed=3, windDirection=180,
+            weatherStatus='01d')}, cache_file)
+    server.weather = response(20)
+    home_board = HomeBoard.__new__(HomeBoard)
+    home_board.weatherModule = weather.WeatherModule({'url': f'http://127.0.0.1:{server.server_address[1]}/weather',
+                                                      'api-key': 'key', 'lang': None, 'units': 'metric',
+                                                      'city-name': 'Kraków', 'cache-ttl': 600,
+                                                      'cache-path': str(tmp_path)})
+    home_board.calendarModule = home_board.imageModule = home_board.displayModule = recorder = Recorder()
+    # stale data is shown right away while fresh data is fetched in the background
+    home_board.refreshWeather()
+    home_board.refreshDisplay()
+    home_board.weatherModule.pendingRefresh.result(10)
+    # the next display refresh shows the fresh data, without waiting for the next weather refresh
+    home_board.refreshDisplay()
+    assert recorder.weather == [10, 20]
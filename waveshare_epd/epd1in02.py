@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 80
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 128
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -110,15 +114,12 @@ class EPD:
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        busy =not(busy & 0x01)
-        while(busy):
-            self.send_command(0x71)
-            busy = epdconfig.digital_read(self.busy_pin)
-            busy =not(busy & 0x01)
+        epdconfig.wait_busy(self.busy_pin, 0, 10, poll=lambda: self.send_command(0x71))
         epdconfig.delay_ms(800)
         logger.debug("e-Paper busy release")        
 
@@ -128,22 +129,14 @@ class EPD:
         self.ReadBusy()
 
     def SetFulltReg(self):
-        self.send_command(0x23)
-        for count in range(0, 42):
-            self.send_data(self.lut_w1[count]) 
+        self.send_bulk(0x23, self.lut_w1[0:42])
         
-        self.send_command(0x24)
-        for count in range(0, 42):
-            self.send_data(self.lut_b1[count])     
+        self.send_bulk(0x24, self.lut_b1[0:42])
 
     def SetPartReg(self):
-        self.send_command(0x23)
-        for count in range(0, 42):
-            self.send_data(self.lut_w[count]) 
+        self.send_bulk(0x23, self.lut_w[0:42])
         
-        self.send_command(0x24)
-        for count in range(0, 42):
-            self.send_data(self.lut_b[count])     
+        self.send_bulk(0x24, self.lut_b[0:42])
 
     def Init(self):
         if (epdconfig.module_init() != 0):
@@ -239,26 +232,7 @@ class EPD:
         return 0
     
     def getbuffer(self, image):
-        buf = [0xFF] * (int(self.width / 8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, image):
         if (image == None):
@@ -269,15 +243,9 @@ class EPD:
         else:
             Width = self.width / 8 + 1
             
-        self.send_command(0x10)
-        for j in range(0, self.height):
-            for i in range(0, int(Width)):
-                self.send_data(0xff)  
+        self.send_bulk(0x10, epdbuffer.blank(0xff, self.height * int(Width)))
         
-        self.send_command(0x13)
-        for j in range(0, self.height):
-            for i in range(0, int(Width)):
-                self.send_data(image[i + j * int(Width)])  
+        self.send_bulk(0x13, image[0:self.height * int(Width)])
         self.TurnOnDisplay()
         
     def Clear(self):
@@ -289,17 +257,19 @@ class EPD:
             
         Height = self.height
         
-        self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(0x00)  
+        self.send_bulk(0x10, epdbuffer.blank(0x00, Height * int(Width)))
         
-        self.send_command(0x13)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(0xff)  
+        self.send_bulk(0x13, epdbuffer.blank(0xff, Height * int(Width)))
         self.TurnOnDisplay()
 
+    # Refreshes buffer with the partial waveform. The whole frame is sent, the window x0..y1 only tells what changed.
+    # old is the frame shown now, white when unknown.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        if old is None:
+            old = epdbuffer.blank(0xFF, len(buffer))
+        self.Partial_Init()
+        self.DisplayPartial(old, buffer)
+
     def DisplayPartial(self, old_Image, Image):
 
         # Set partial Windows */
@@ -320,15 +290,9 @@ class EPD:
             
         Height = self.height
         # send data
-        self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(old_Image[i + j * int(Width)])
-
-        self.send_command(0x13)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(Image[i + j * int(Width)])
+        self.send_bulk(0x10, old_Image[0:Height * int(Width)])
+
+        self.send_bulk(0x13, Image[0:Height * int(Width)])
 
         # Set partial refresh
         self.TurnOnDisplay()
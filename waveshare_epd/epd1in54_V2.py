@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 200
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 200
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -119,10 +123,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):
-            epdconfig.delay_ms(20)
+        epdconfig.wait_busy(self.busy_pin, 1, 20)
         logger.debug("e-Paper busy release")
 
     def TurnOnDisplay(self):
@@ -138,8 +144,7 @@ class EPD:
         self.ReadBusy()
 
     def lut(self, lut):
-        self.send_command(0x32) # WRITE_LUT_REGISTER
-        self.send_data2(lut)
+        self.send_bulk(0x32, lut) # WRITE_LUT_REGISTER
             
     def set_lut(self, lut):
         self.lut(lut)
@@ -250,59 +255,43 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
 
-        self.send_command(0x24)
-        self.send_data2([color] * self.height * linewidth)
+        self.send_bulk(0x24, epdbuffer.blank(color, self.height * linewidth))
                 
         self.TurnOnDisplay()
         
     def getbuffer(self, image):
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, image):
         if (image == None):
             return
             
-        self.send_command(0x24)
-        self.send_data2(image)   
+        self.send_bulk(0x24, image)
         self.TurnOnDisplay()
         
     def displayPartBaseImage(self, image):
         if (image == None):
             return
         
-        self.send_command(0x24)
-        self.send_data2(image)
+        self.send_bulk(0x24, image)
         
-        self.send_command(0x26)
-        self.send_data2(image)
+        self.send_bulk(0x26, image)
                 
         self.TurnOnDisplay()
         
+    # Refreshes buffer with the partial waveform. The whole frame is sent, the window x0..y1 only tells what changed.
+    # old is the frame shown now, the controller keeps it in RAM otherwise.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.init(1)
+        if old is not None:
+            self.send_bulk(0x26, old)
+        self.displayPart(buffer)
+
     def displayPart(self, image):
         if (image == None):
             return
         
-        self.send_command(0x24)
-        self.send_data2(image)
+        self.send_bulk(0x24, image)
                 
         self.TurnOnDisplayPart()
         
@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 200
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 200
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -75,39 +79,25 @@ class EPD:
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):
-            epdconfig.delay_ms(100)    
+        epdconfig.wait_busy(self.busy_pin, 0, 100)
         logger.debug("e-Paper busy release")
       
     def set_lut_bw(self):
-        self.send_command(0x20) # vcom
-        for count in range(0, 15):
-            self.send_data(self.lut_vcom0[count])
-        self.send_command(0x21) # ww --
-        for count in range(0, 15):
-            self.send_data(self.lut_w[count])
-        self.send_command(0x22) # bw r
-        for count in range(0, 15):
-            self.send_data(self.lut_b[count])
-        self.send_command(0x23) # wb w
-        for count in range(0, 15):
-            self.send_data(self.lut_g1[count])
-        self.send_command(0x24) # bb b
-        for count in range(0, 15):
-            self.send_data(self.lut_g2[count])
+        self.send_bulk(0x20, self.lut_vcom0[0:15]) # vcom
+        self.send_bulk(0x21, self.lut_w[0:15]) # ww --
+        self.send_bulk(0x22, self.lut_b[0:15]) # bw r
+        self.send_bulk(0x23, self.lut_g1[0:15]) # wb w
+        self.send_bulk(0x24, self.lut_g2[0:15]) # bb b
 
     def set_lut_red(self):
-        self.send_command(0x25)
-        for count in range(0, 15):
-            self.send_data(self.lut_vcom1[count])
-        self.send_command(0x26)
-        for count in range(0, 15):
-            self.send_data(self.lut_red0[count])
-        self.send_command(0x27)
-        for count in range(0, 15):
-            self.send_data(self.lut_red1[count])
+        self.send_bulk(0x25, self.lut_vcom1[0:15])
+        self.send_bulk(0x26, self.lut_red0[0:15])
+        self.send_bulk(0x27, self.lut_red1[0:15])
             
     def init(self):
         if (epdconfig.module_init() != 0):
@@ -146,57 +136,31 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        buf = [0xFF] * int(self.width * self.height / 8)
         # Set buffer to value of Python Imaging Library image.
         # Image must be in mode 1.
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
+        imwidth, imheight = image.size
         if imwidth != self.width or imheight != self.height:
             raise ValueError('Image must be same dimensions as display \
                 ({0}x{1}).' .format(self.width, self.height))
-
-        pixels = image_monocolor.load()
-        for y in range(self.height):
-            for x in range(self.width):
-                # Set the bits for the column of pixels at the current position.
-                if pixels[x, y] == 0:
-                    buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, blackimage, redimage):
         # send black data
         if (blackimage != None):
-            self.send_command(0x10) # DATA_START_TRANSMISSION_1
-            for i in range(0, int(self.width * self.height / 8)):
-                temp = 0x00
-                for bit in range(0, 4):
-                    if (blackimage[i] & (0x80 >> bit) != 0):
-                        temp |= 0xC0 >> (bit * 2)
-                self.send_data(temp)  
-                temp = 0x00
-                for bit in range(4, 8):
-                    if (blackimage[i] & (0x80 >> bit) != 0):
-                        temp |= 0xC0 >> ((bit - 4) * 2)
-                self.send_data(temp)
+            # every black pixel is sent as 2 bits
+            self.send_bulk(0x10, epdbuffer.pack_planes(self.width, self.height, (0x00, 0x03), 2, blackimage)) # DATA_START_TRANSMISSION_1
                 
         # send red data        
         if (redimage != None):
-            self.send_command(0x13) # DATA_START_TRANSMISSION_2
-            for i in range(0, int(self.width * self.height / 8)):
-                self.send_data(redimage[i])  
+            self.send_bulk(0x13, redimage[0:int(self.width * self.height / 8)]) # DATA_START_TRANSMISSION_2
 
         self.send_command(0x12) # DISPLAY_REFRESH
         self.ReadBusy()
 
     def Clear(self):
-        self.send_command(0x10) # DATA_START_TRANSMISSION_1
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
-            self.send_data(0xFF)
+        self.send_bulk(0x10, epdbuffer.blank(0xFF, int(self.width * self.height / 8) * 2)) # DATA_START_TRANSMISSION_1
             
-        self.send_command(0x13) # DATA_START_TRANSMISSION_2
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_bulk(0x13, epdbuffer.blank(0xFF, int(self.width * self.height / 8))) # DATA_START_TRANSMISSION_2
 
         self.send_command(0x12) # DISPLAY_REFRESH
         self.ReadBusy()
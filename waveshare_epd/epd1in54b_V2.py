@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 200
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 200
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -74,10 +78,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):
-            epdconfig.delay_ms(100)    
+        epdconfig.wait_busy(self.busy_pin, 1, 100)
         logger.debug("e-Paper busy release")
         
     def init(self):
@@ -123,43 +129,23 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        buf = [0xFF] * int(self.width * self.height / 8)
         # Set buffer to value of Python Imaging Library image.
         # Image must be in mode 1.
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
+        imwidth, imheight = image.size
         if imwidth != self.width or imheight != self.height:
             raise ValueError('Image must be same dimensions as display \
                 ({0}x{1}).' .format(self.width, self.height))
-
-        pixels = image_monocolor.load()
-        for y in range(self.height):
-            for x in range(self.width):
-                # Set the bits for the column of pixels at the current position.
-                if pixels[x, y] == 0:
-                    buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, blackimage, redimage):
 
-        if self.width%8 == 0:
-            linewidth = int(self.width/8)
-        else:
-            linewidth = int(self.width/8) + 1
-
-        buf = [0x00] * self.height * linewidth
-
         # send black data
         if (blackimage != None):
-            self.send_command(0x24) # DATA_START_TRANSMISSION_1
-            self.send_data2(blackimage)
+            self.send_bulk(0x24, blackimage) # DATA_START_TRANSMISSION_1
                 
         # send red data        
         if (redimage != None):
-            self.send_command(0x26) # DATA_START_TRANSMISSION_2
-            for i in range(0, int(self.width * self.height / 8)):
-                buf[i] = ~redimage[i]
-            self.send_data2(buf)
+            self.send_bulk(0x26, epdbuffer.invert(redimage[0:int(self.width * self.height / 8)])) # DATA_START_TRANSMISSION_2
 
         self.send_command(0x22) # DISPLAY_REFRESH
         self.send_data(0xF7)
@@ -172,11 +158,9 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
 
-        self.send_command(0x24) # DATA_START_TRANSMISSION_1
-        self.send_data2([0xff] * int(self.height * linewidth))
+        self.send_bulk(0x24, epdbuffer.blank(0xff, int(self.height * linewidth))) # DATA_START_TRANSMISSION_1
             
-        self.send_command(0x26) # DATA_START_TRANSMISSION_2
-        self.send_data2([0x00] * int(self.height * linewidth))
+        self.send_bulk(0x26, epdbuffer.blank(0x00, int(self.height * linewidth))) # DATA_START_TRANSMISSION_2
 
         self.send_command(0x22) # DISPLAY_REFRESH
         self.send_data(0xF7)
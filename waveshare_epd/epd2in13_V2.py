@@ -30,6 +30,8 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
+from PIL import Image
 
 # Display resolution
 EPD_WIDTH       = 122
@@ -38,6 +40,9 @@ EPD_HEIGHT      = 250
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -112,9 +117,11 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)    
+        epdconfig.wait_busy(self.busy_pin, 1, 100)      # 0: idle, 1: busy
 
     def TurnOnDisplay(self):
         self.send_command(0x22)
@@ -180,9 +187,7 @@ class EPD:
             self.send_command(0x3B)     #Gate time
             self.send_data(self.lut_full_update[75])
 
-            self.send_command(0x32)
-            for count in range(70):
-                self.send_data(self.lut_full_update[count])
+            self.send_bulk(0x32, self.lut_full_update[0:70])
 
             self.send_command(0x4E)   # set RAM x address count to 0
             self.send_data(0x00)
@@ -196,9 +201,7 @@ class EPD:
 
             self.ReadBusy()
 
-            self.send_command(0x32)
-            for count in range(70):
-                self.send_data(self.lut_partial_update[count])
+            self.send_bulk(0x32, self.lut_partial_update[0:70])
 
             self.send_command(0x37)
             self.send_data(0x00)
@@ -223,61 +226,48 @@ class EPD:
             linewidth = int(self.width/8)
         else:
             linewidth = int(self.width/8) + 1
-         
-        buf = [0xFF] * (linewidth * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        
-        if(imwidth == self.width and imheight == self.height):
+
+        img = image.convert('1')
+        if(img.size == (self.width, self.height)):
             logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):                    
-                    if pixels[x, y] == 0:
-                        x = imwidth - x
-                        buf[int(x / 8) + y * linewidth] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
+            # Columns are written mirrored, shifted by one into the row padding.
+            mirrored = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+            img = Image.new('1', (self.width + 1, self.height), 255)
+            img.paste(mirrored, (1, 0))
+        elif(img.size == (self.height, self.width)):
             logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        newy = imwidth - newy - 1
-                        buf[int(newx / 8) + newy*linewidth] &= ~(0x80 >> (y % 8))
-        return buf   
-        
+            img = img.transpose(Image.Transpose.TRANSPOSE)
+        else:
+            return bytearray([0xFF]) * (linewidth * self.height)
+        return epdbuffer.tobytes_1bpp(img, linewidth)
         
     def display(self, image):
-        self.send_command(0x24)
-        self.send_data2(image)   
+        self.send_bulk(0x24, image)
         self.TurnOnDisplay()
         
+    # Refreshes buffer with the partial waveform. The whole frame is sent, the window x0..y1 only tells what changed.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.init(self.PART_UPDATE)
+        self.displayPartial(buffer)
+
     def displayPartial(self, image):
         if self.width%8 == 0:
             linewidth = int(self.width/8)
         else:
             linewidth = int(self.width/8) + 1
 
-        buf = [0x00] * self.height * linewidth
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                buf[i + j * linewidth] = ~image[i + j * linewidth]
+        buf = epdbuffer.invert(image[0:self.height * linewidth])
 
-        self.send_command(0x24)
-        self.send_data2(image)   
+        self.send_bulk(0x24, image)
                 
                 
-        self.send_command(0x26)
-        self.send_data2(buf)  
+        self.send_bulk(0x26, buf)
         self.TurnOnDisplayPart()
 
     def displayPartBaseImage(self, image):
-        self.send_command(0x24)
-        self.send_data2(image)   
+        self.send_bulk(0x24, image)
                 
-        self.send_command(0x26)
-        self.send_data2(image)  
+        self.send_bulk(0x26, image)
         self.TurnOnDisplay()
     
     def Clear(self, color=0xFF):
@@ -287,13 +277,9 @@ class EPD:
             linewidth = int(self.width/8) + 1
         # logger.debug(linewidth)
         
-        buf = [0x00] * self.height * linewidth
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                buf[i + j * linewidth] = color
+        buf = epdbuffer.blank(color, self.height * linewidth)
 
-        self.send_command(0x24)
-        self.send_data2(buf)
+        self.send_bulk(0x24, buf)
                 
         # self.send_command(0x26)
         # for j in range(0, self.height):
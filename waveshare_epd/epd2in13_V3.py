@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 122
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 250
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -131,14 +135,17 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
     
+    # send a command followed by its data in one transfer
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+    
     '''
     function :Wait until the busy_pin goes LOW
     parameter:
     '''
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)  
+        epdconfig.wait_busy(self.busy_pin, 1, 10)      # 0: idle, 1: busy
         logger.debug("e-Paper busy release")
 
     '''
@@ -167,9 +174,7 @@ class EPD:
         lut : lut data
     '''    
     def Lut(self, lut):
-        self.send_command(0x32)
-        for i in range(0, 153):
-            self.send_data(lut[i])
+        self.send_bulk(0x32, lut[0:153])
         self.ReadBusy()
     
     '''
@@ -271,20 +276,7 @@ class EPD:
         image : Image data
     '''
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return [0x00] * (int(self.width/8) * self.height)
-
-        buf = bytearray(img.tobytes('raw'))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height, rotate_first=True, white_padding=False)
         
     '''
     function : Sends the image buffer in RAM to e-Paper and displays
@@ -297,12 +289,21 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
 
-        self.send_command(0x24)
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                self.send_data(image[i + j * linewidth])   
+        self.send_bulk(0x24, image[0:self.height * linewidth])
         self.TurnOnDisplay()
     
+    '''
+    function : Refreshes buffer with the partial waveform. The whole frame is sent,
+               the window x0..y1 only tells what changed
+    parameter:
+        buffer : Image data
+        x0, y0, x1, y1 : changed window, ends exclusive
+        old : frame shown now, unused
+    '''
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.init()
+        self.displayPartial(buffer)
+
     '''
     function : Sends the image buffer in RAM to e-Paper and partial refresh
     parameter:
@@ -337,11 +338,7 @@ class EPD:
         self.SetWindow(0, 0, self.width - 1, self.height - 1)
         self.SetCursor(0, 0)
         
-        self.send_command(0x24) # WRITE_RAM
-        # for j in range(0, self.height):
-        #     for i in range(0, linewidth):
-        #         self.send_data(image[i + j * linewidth])   
-        self.send_data2(image)  
+        self.send_bulk(0x24, image) # WRITE_RAM
         self.TurnOnDisplayPart()
 
     '''
@@ -350,11 +347,9 @@ class EPD:
         image : Image data
     '''
     def displayPartBaseImage(self, image):
-        self.send_command(0x24)
-        self.send_data2(image)  
+        self.send_bulk(0x24, image)
                 
-        self.send_command(0x26)
-        self.send_data2(image)  
+        self.send_bulk(0x26, image)
         self.TurnOnDisplay()
     
     '''
@@ -368,8 +363,7 @@ class EPD:
             linewidth = int(self.width/8) + 1
         # logger.debug(linewidth)
         
-        self.send_command(0x24)
-        self.send_data2([color] * int(self.height * linewidth))  
+        self.send_bulk(0x24, epdbuffer.blank(color, int(self.height * linewidth)))
         self.TurnOnDisplay()
 
     '''
@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 122
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 250
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -75,11 +79,13 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     # judge e-Paper whether is busy
     def busy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) != 0): 
-            epdconfig.delay_ms(10)
+        epdconfig.wait_busy(self.busy_pin, 1, 10)
         logger.debug("e-Paper busy release")
 
     # set the display window
@@ -146,28 +152,13 @@ class EPD:
 
     # image converted to bytearray
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return [0x00] * (int(self.width/8) * self.height)
-
-        buf = bytearray(img.tobytes('raw'))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height, rotate_first=True, white_padding=False)
 
     # display image
     def display(self, imageblack, imagered):
-        self.send_command(0x24)
-        self.send_data2(imageblack)
+        self.send_bulk(0x24, imageblack)
         
-        self.send_command(0x26)
-        self.send_data2(imagered)
+        self.send_bulk(0x26, imagered)
         
         self.ondisplay()
         
@@ -178,13 +169,11 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
             
-        buf = [0xff] * (int(linewidth * self.height))
+        buf = epdbuffer.blank(0xff, int(linewidth * self.height))
             
-        self.send_command(0x24)
-        self.send_data2(buf)
+        self.send_bulk(0x24, buf)
         
-        self.send_command(0x26)
-        self.send_data2(buf)
+        self.send_bulk(0x26, buf)
         
         self.ondisplay()
 
@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 import PIL
 from PIL import Image
@@ -42,6 +43,9 @@ EPD_HEIGHT      = 250
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -81,11 +85,13 @@ class EPD:
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy H")
         epdconfig.delay_ms(100)
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(5)
+        epdconfig.wait_busy(self.busy_pin, 0, 5)      # 0: idle, 1: busy
         logger.debug("e-Paper busy release")
         
     def SetWindow(self):
@@ -207,13 +213,12 @@ class EPD:
             Width = self.width // 4 + 1
         Height = self.height
 
-        self.send_command(0x10)
+        # each row is padded with 0x00 up to Source_BITS
+        pad = bytes(max(self.Source_BITS//4 - 31, 0))
+        buf = bytearray()
         for j in range(0, Height):
-            for i in range(0, self.Source_BITS//4):
-                if i < 31 :
-                    self.send_data(image[i + j * Width])
-                else :
-                    self.send_data(0x00)
+            buf += bytes(image[j * Width:j * Width + min(31, self.Source_BITS//4)]) + pad
+        self.send_bulk(0x10, buf)
                     
         self.TurnOnDisplay()
         
@@ -222,10 +227,7 @@ class EPD:
         Height = self.height
 
 
-        self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, Width):
-                    self.send_data(color)
+        self.send_bulk(0x10, epdbuffer.blank(color, Height * Width))
         self.TurnOnDisplay()
 
     def sleep(self):
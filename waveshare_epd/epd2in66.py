@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 152
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 296
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -95,11 +99,13 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+
 
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      #  0: idle, 1: busy
-            epdconfig.delay_ms(200) 
+        epdconfig.wait_busy(self.busy_pin, 1, 200)      #  0: idle, 1: busy
         logger.debug("e-Paper busy release") 
 
 
@@ -158,39 +164,14 @@ class EPD:
 
 
     def load_lut(self, lut):
-        self.send_command(0x32)
-        # for i in range(0, 153):
-        #     self.send_data(lut[i])
-        self.send_data2(lut)
+        self.send_bulk(0x32, lut)
 
     def turnon_display(self):
         self.send_command(0x20)
         self.ReadBusy()
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
-
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, image):
         if (image == None):
@@ -202,8 +183,7 @@ class EPD:
         self.send_data(0x27)
         self.send_data(0x01)
 
-        self.send_command(0x24)
-        self.send_data2(image)
+        self.send_bulk(0x24, image)
         self.turnon_display()
         
 
@@ -219,13 +199,11 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
 
-        buf = [0xff] * int(self.height * linewidth)
+        buf = epdbuffer.blank(0xff, int(self.height * linewidth))
 
-        self.send_command(0x24)
-        self.send_data2(buf)   
+        self.send_bulk(0x24, buf)
 
-        self.send_command(0x26)
-        self.send_data2(buf) 
+        self.send_bulk(0x26, buf)
 
         self.turnon_display()
 
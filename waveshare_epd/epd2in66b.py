@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 152
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 296
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -75,11 +79,13 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+
 
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      #  0: idle, 1: busy
-            epdconfig.delay_ms(20) 
+        epdconfig.wait_busy(self.busy_pin, 1, 20)      #  0: idle, 1: busy
         logger.debug("e-Paper busy release") 
 
 
@@ -131,40 +137,15 @@ class EPD:
         self.ReadBusy()
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, Blackimage, Redimage):
         if (Blackimage == None or Redimage == None):
             return   
-        Redimage_1 = [0x00] * len(Redimage)
-        for i in range(len(Redimage)) :
-            Redimage_1[i] = ~Redimage[i]    
-        self.send_command(0x24)
-        self.send_data2(Blackimage) 
-
-        self.send_command(0x26)
-        self.send_data2(Redimage_1) 
+        Redimage_1 = epdbuffer.invert(Redimage)
+        self.send_bulk(0x24, Blackimage)
+
+        self.send_bulk(0x26, Redimage_1)
                 
         self.turnon_display()
         
@@ -175,11 +156,9 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
 
-        self.send_command(0x24)
-        self.send_data2([0xff] * int(self.height * linewidth)) 
+        self.send_bulk(0x24, epdbuffer.blank(0xff, int(self.height * linewidth)))
 
-        self.send_command(0x26)
-        self.send_data2([0x00] * int(self.height * linewidth))
+        self.send_bulk(0x26, epdbuffer.blank(0x00, int(self.height * linewidth)))
 
         self.turnon_display()
 
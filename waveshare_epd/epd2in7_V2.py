@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 176
@@ -42,6 +43,9 @@ GRAY4  = 0x00 #Blackest
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -96,11 +100,19 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data2(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+        
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
         
     def ReadBusy(self):        
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      #  1: idle, 0: busy
-            epdconfig.delay_ms(20)                
+        epdconfig.wait_busy(self.busy_pin, 1, 20)      #  1: idle, 0: busy
         logger.debug("e-Paper busy release")
     
     def TurnOnDisplay(self):
@@ -128,9 +140,7 @@ class EPD:
         self.ReadBusy()
         
     def Lut(self):
-        self.send_command(0x32)
-        for i in range(159):
-            self.send_data(self.LUT_DATA_4Gray[i])
+        self.send_bulk(0x32, self.LUT_DATA_4Gray[0:159])
     
     def init(self):
         if (epdconfig.module_init() != 0):
@@ -265,64 +275,10 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
     
     def getbuffer_4Gray(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 4) * self.height)
-        image_monocolor = image.convert('L')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        i=0
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((x + (y * self.width))/4)] = ((pixels[x-3, y]&0xc0) | (pixels[x-2, y]&0xc0)>>2 | (pixels[x-1, y]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6)
-                        
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for x in range(imwidth):
-                for y in range(imheight):
-                    newx = y
-                    newy = self.height - x - 1
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((newx + (newy * self.width))/4)] = ((pixels[x, y-3]&0xc0) | (pixels[x, y-2]&0xc0)>>2 | (pixels[x, y-1]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6) 
-        return buf
+        return epdbuffer.pack_4gray(image, self.width, self.height)
     
     def Clear(self):
         if(self.width % 8 == 0):
@@ -330,10 +286,7 @@ class EPD:
         else:
             Width = self.width // 8 +1
         Height = self.height
-        self.send_command(0x24)
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(0XFF)
+        self.send_bulk(0x24, epdbuffer.blank(0XFF, Height * Width))
         self.TurnOnDisplay()
     
     def display(self, image):
@@ -342,10 +295,7 @@ class EPD:
         else:
             Width = self.width // 8 +1
         Height = self.height
-        self.send_command(0x24)
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(image[i + j * Width])
+        self.send_bulk(0x24, image[0:Height * Width])
         self.TurnOnDisplay()
         
     def display_Fast(self, image):
@@ -354,10 +304,7 @@ class EPD:
         else:
             Width = self.width // 8 +1
         Height = self.height
-        self.send_command(0x24)
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(image[i + j * Width])
+        self.send_bulk(0x24, image[0:Height * Width])
         self.TurnOnDisplay_Fast()
         
     def display_Base(self, image):
@@ -366,15 +313,9 @@ class EPD:
         else:
             Width = self.width // 8 +1
         Height = self.height
-        self.send_command(0x24)   #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(image[i + j * Width])
+        self.send_bulk(0x24, image[0:Height * Width])   #Write Black and White image to RAM
                 
-        self.send_command(0x26)  #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(image[i + j * Width])
+        self.send_bulk(0x26, image[0:Height * Width])  #Write Black and White image to RAM
         self.TurnOnDisplay()
         
     def display_Base_color(self, color):
@@ -383,18 +324,12 @@ class EPD:
         else:
             Width = self.width // 8 +1
         Height = self.height
-        self.send_command(0x24)   #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(color)
+        self.send_bulk(0x24, epdbuffer.blank(color, Height * Width))   #Write Black and White image to RAM
                 
-        self.send_command(0x26)  #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(color)
+        self.send_bulk(0x26, epdbuffer.blank(color, Height * Width))  #Write Black and White image to RAM
         # self.TurnOnDisplay()
     
-    def display_Partial(self, Image, Xstart, Ystart, Xend, Yend):
+    def display_Partial(self, Image, Xstart, Ystart, Xend, Yend, old=None):
         if((Xstart % 8 + Xend % 8 == 8 & Xstart % 8 > Xend % 8) | Xstart % 8 + Xend % 8 == 0 | (Xend - Xstart)%8 == 0):
             Xstart = Xstart // 8
             Xend = Xend // 8
@@ -429,84 +364,32 @@ class EPD:
         self.send_data(Yend & 0xff)    # RAM y address end at 00h;
         self.send_data((Yend>>8) & 0x01)   
 
+        window = (max(Xstart, 0), max(Ystart, 0), min(Xend + 1, Width), min(Yend + 1, Height))
+        if old is not None:
+            self.SetCursor_Partial(Xstart, Ystart)
+            self.send_bulk(0x26, epdbuffer.window(old, Width, *window))   #Write previous image to RAM
+        self.SetCursor_Partial(Xstart, Ystart)
+        self.send_bulk(0x24, epdbuffer.window(Image, Width, *window))   #Write Black and White image to RAM
+        self.TurnOnDisplay_Partial()
+
+    def SetCursor_Partial(self, Xstart, Ystart):
         self.send_command(0x4E)   # set RAM x address count to 0;
         self.send_data(Xstart & 0xff)
         self.send_command(0x4F)   # set RAM y address count to 0X127;    
         self.send_data(Ystart & 0xff)
         self.send_data((Ystart>>8) & 0x01)
 
-        self.send_command(0x24)   #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                if((j > Ystart-1) & (j < (Yend + 1)) & (i > Xstart-1) & (i < (Xend + 1))):
-                    self.send_data(Image[i + j * Width])
-        self.TurnOnDisplay_Partial()
+    # Refreshes the window [x0, x1) x [y0, y1) of buffer with the partial waveform, old is the frame shown now.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        if (epdconfig.module_init() != 0):
+            return -1
+        self.display_Partial(buffer, x0, y0, x1, y1, old)
   
     def display_4Gray(self, image):
-        self.send_command(0x24)
-        for i in range(0, 5808):                     #5808*4  46464
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x01  
-                    elif(temp2 == 0x80): 
-                        temp3 |= 0x01 
-                    else: #0x40
-                        temp3 |= 0x00 
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0): 
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00): 
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x01
-                    else :   #0x40
-                        temp3 |= 0x00	
-                    if(j!=1 or k!=1):				
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-            
-        self.send_command(0x26)	       
-        for i in range(0, 5808):                #5808*4  46464
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00
-                    else: #0x40
-                        temp3 |= 0x01 
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0): 
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00): 
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00 
-                    else:    #0x40
-                            temp3 |= 0x01	
-                    if(j!=1 or k!=1):					
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-        
+        self.send_bulk(0x24, epdbuffer.bitplane(image, self.width, self.height, (1, 0, 1, 0)))
+
+        self.send_bulk(0x26, epdbuffer.bitplane(image, self.width, self.height, (1, 1, 0, 0)))
+
         self.TurnOnDisplay_4GRAY()
 
     def sleep(self):
@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 176
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 264
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -76,11 +80,13 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     # Read Busy
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)
+        epdconfig.wait_busy(self.busy_pin, 1, 10)      # 0: idle, 1: busy
         logger.debug("e-Paper busy release")
             
     # Setting the display window
@@ -127,53 +133,26 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
     
     # Sends the image buffer in RAM to e-Paper and displays
     def display(self, imageblack, imagered):
         Width = self.width / 8 
         Height = self.height 
 
-        buf = [0x00] * int(Width * Height)
-        for i in range(0, int(Width * Height)):
-            buf[i] = ~imagered[i]
+        buf = epdbuffer.invert(imagered[0:int(Width * Height)])
 
-        self.send_command(0x24) 
-        self.send_data2(imageblack) 
+        self.send_bulk(0x24, imageblack)
 
-        self.send_command(0x26) 
-        self.send_data2(buf) 
+        self.send_bulk(0x26, buf)
         
         self.TurnOnDisplay()
 
     # Clear the screen
     def Clear(self):
-        self.send_command(0x24)
-        self.send_data2([0xff] * int(self.width * self.height / 8))
+        self.send_bulk(0x24, epdbuffer.blank(0xff, int(self.width * self.height / 8)))
 
-        self.send_command(0x26)
-        self.send_data2([0x00] * int(self.width * self.height / 8))
+        self.send_bulk(0x26, epdbuffer.blank(0x00, int(self.width * self.height / 8)))
             
         self.TurnOnDisplay()
         
@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 128
@@ -37,6 +38,9 @@ EPD_HEIGHT      = 296
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -117,10 +121,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      #  0: idle, 1: busy
-            epdconfig.delay_ms(10) 
+        epdconfig.wait_busy(self.busy_pin, 1, 10)      #  0: idle, 1: busy
         logger.debug("e-Paper busy release")  
 
     def TurnOnDisplay(self):
@@ -136,9 +142,7 @@ class EPD:
         self.ReadBusy()
 
     def lut(self, lut):
-        self.send_command(0x32)
-        for i in range(0, 153):
-            self.send_data(lut[i])
+        self.send_bulk(0x32, lut[0:153])
         self.ReadBusy()
 
     def SetLut(self, lut):
@@ -206,48 +210,29 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, image):
         if (image == None):
             return            
-        self.send_command(0x24) # WRITE_RAM
-        self.send_data2(image)   
+        self.send_bulk(0x24, image) # WRITE_RAM
         self.TurnOnDisplay()
 
     def display_Base(self, image):
         if (image == None):
             return   
             
-        self.send_command(0x24) # WRITE_RAM
-        self.send_data2(image)
+        self.send_bulk(0x24, image) # WRITE_RAM
                 
-        self.send_command(0x26) # WRITE_RAM
-        self.send_data2(image)   
+        self.send_bulk(0x26, image) # WRITE_RAM
                 
         self.TurnOnDisplay()
         
+    # Refreshes buffer with the partial waveform. The whole frame is sent, the window x0..y1 only tells what changed.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.init()
+        self.display_Partial(buffer)
+
     def display_Partial(self, image):
         if (image == None):
             return
@@ -281,8 +266,7 @@ class EPD:
         self.SetWindow(0, 0, self.width - 1, self.height - 1)
         self.SetCursor(0, 0)
         
-        self.send_command(0x24) # WRITE_RAM
-        self.send_data2(image)   
+        self.send_bulk(0x24, image) # WRITE_RAM
         self.TurnOnDisplay_Partial()
 
     def Clear(self, color=0xFF):
@@ -291,8 +275,7 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
 
-        self.send_command(0x24) # WRITE_RAM
-        self.send_data2([color] * int(self.height * linewidth)) 
+        self.send_bulk(0x24, epdbuffer.blank(color, int(self.height * linewidth))) # WRITE_RAM
         self.TurnOnDisplay()
 
     def sleep(self):
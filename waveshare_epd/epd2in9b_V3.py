@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 128
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 296
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -74,12 +78,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        self.send_command(0X71)
-        while(epdconfig.digital_read(self.busy_pin) == 0):      #  0: idle, 1: busy
-            self.send_command(0X71)
-            epdconfig.delay_ms(200)                
+        epdconfig.wait_busy(self.busy_pin, 0, 200, poll=lambda: self.send_command(0X71))      #  0: idle, 1: busy
         logger.debug("e-Paper busy release")
         
     def init(self):
@@ -107,46 +111,21 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, blackimage, ryimage): # ryimage: red or yellow image
         if (blackimage != None):
-            self.send_command(0X10)
-            self.send_data2(blackimage)        
+            self.send_bulk(0X10, blackimage)
         if (ryimage != None):
-            self.send_command(0X13)
-            self.send_data2(ryimage)
+            self.send_bulk(0X13, ryimage)
 
         self.send_command(0x12)
         epdconfig.delay_ms(200) 
         self.ReadBusy()
         
     def Clear(self):
-        self.send_command(0X10)
-        self.send_data2([0xff] * int(self.width * self.height / 8))
-        self.send_command(0X13)
-        self.send_data2([0xff] * int(self.width * self.height / 8))
+        self.send_bulk(0X10, epdbuffer.blank(0xff, int(self.width * self.height / 8)))
+        self.send_bulk(0X13, epdbuffer.blank(0xff, int(self.width * self.height / 8)))
 
         self.send_command(0x12)
         epdconfig.delay_ms(200) 
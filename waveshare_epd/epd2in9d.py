@@ -33,6 +33,7 @@
 from distutils.command.build_scripts import build_scripts
 import logging
 from . import epdconfig
+from . import epdbuffer
 from PIL import Image
 import RPi.GPIO as GPIO
 
@@ -43,6 +44,9 @@ EPD_HEIGHT      = 296
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -138,11 +142,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            self.send_command(0x71)
-            epdconfig.delay_ms(10)  
+        epdconfig.wait_busy(self.busy_pin, 0, 10, poll=lambda: self.send_command(0x71))      # 0: idle, 1: busy
         logger.debug("e-Paper busy release")
         
     def TurnOnDisplay(self):
@@ -206,52 +211,29 @@ class EPD:
         self.send_command(0X50)
         self.send_data(0x97)
         
-        self.send_command(0x20)         # vcom
-        self.send_data2(self.lut_vcom1)
-        self.send_command(0x21)         # ww --
-        self.send_data2(self.lut_ww1)
-        self.send_command(0x22)         # bw r
-        self.send_data2(self.lut_bw1)
-        self.send_command(0x23)         # wb w
-        self.send_data2(self.lut_wb1)
-        self.send_command(0x24)         # bb b
-        self.send_data2(self.lut_bb1)
+        self.send_bulk(0x20, self.lut_vcom1)         # vcom
+        self.send_bulk(0x21, self.lut_ww1)         # ww --
+        self.send_bulk(0x22, self.lut_bw1)         # bw r
+        self.send_bulk(0x23, self.lut_wb1)         # wb w
+        self.send_bulk(0x24, self.lut_bb1)         # bb b
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, image):
-        self.send_command(0x10)
-        self.send_data2([0x00] * int(self.width * self.height / 8))
+        self.send_bulk(0x10, epdbuffer.blank(0x00, int(self.width * self.height / 8)))
         epdconfig.delay_ms(10)
         
-        self.send_command(0x13)
-        self.send_data2(image)
+        self.send_bulk(0x13, image)
         epdconfig.delay_ms(10)
         
         self.TurnOnDisplay()
         
+    # Refreshes buffer with the partial waveform. The whole frame is sent, the window x0..y1 only tells what changed.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.init()
+        self.DisplayPartial(buffer)
+
     def DisplayPartial(self, image):
         self.SetPartReg()
         self.send_command(0x91)
@@ -266,26 +248,20 @@ class EPD:
         self.send_data(0x28)
         
 
-        buf = [0x00] * int(self.width * self.height / 8)
-        for i in range(0, int(self.width * self.height / 8)):
-            buf[i] = ~image[i]
-        self.send_command(0x10)
-        self.send_data2(image)
+        buf = epdbuffer.invert(image[0:int(self.width * self.height / 8)])
+        self.send_bulk(0x10, image)
         epdconfig.delay_ms(10)
         
-        self.send_command(0x13)
-        self.send_data2(buf)
+        self.send_bulk(0x13, buf)
         epdconfig.delay_ms(10)
           
         self.TurnOnDisplay()
         
     def Clear(self):
-        self.send_command(0x10)
-        self.send_data2([0x00] * int(self.width * self.height / 8))
+        self.send_bulk(0x10, epdbuffer.blank(0x00, int(self.width * self.height / 8)))
         epdconfig.delay_ms(10)
         
-        self.send_command(0x13)
-        self.send_data2([0xFF] * int(self.width * self.height / 8))
+        self.send_bulk(0x13, epdbuffer.blank(0xFF, int(self.width * self.height / 8)))
         epdconfig.delay_ms(10)
         
         self.TurnOnDisplay()
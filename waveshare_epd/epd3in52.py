@@ -30,6 +30,7 @@
 import logging
 from multiprocessing.reduction import recv_handle
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 240
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 360
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -222,27 +226,24 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      #  0: busy, 1: idle
-            epdconfig.delay_ms(5) 
+        epdconfig.wait_busy(self.busy_pin, 0, 5)      #  0: busy, 1: idle
         logger.debug("e-Paper busy release")
 
     def lut(self) :
-        self.send_command(0x20)        # vcom
-        self.send_data2(self.lut_vcom[:42])
+        self.send_bulk(0x20, self.lut_vcom[:42])        # vcom
             
-        self.send_command(0x21)        # ww --
-        self.send_data2(self.lut_ww[:42])
+        self.send_bulk(0x21, self.lut_ww[:42])        # ww --
             
-        self.send_command(0x22)        # bw r
-        self.send_data2(self.lut_bw[:42])
+        self.send_bulk(0x22, self.lut_bw[:42])        # bw r
             
-        self.send_command(0x23)        # wb w
-        self.send_data2(self.lut_bb[:42])
+        self.send_bulk(0x23, self.lut_bb[:42])        # wb w
             
-        self.send_command(0x24)        # bb b
-        self.send_data2(self.lut_wb[:42])
+        self.send_bulk(0x24, self.lut_wb[:42])        # bb b
 
     def refresh(self):
         self.send_command(0x17)
@@ -252,57 +253,43 @@ class EPD:
 
     # LUT download
     def lut_GC(self):
-        self.send_command(0x20);        # vcom
-        self.send_data2(self.lut_R20_GC[:56])
+        self.send_bulk(0x20, self.lut_R20_GC[:56]);        # vcom
             
-        self.send_command(0x21);        # red not use
-        self.send_data2(self.lut_R21_GC[:42])
+        self.send_bulk(0x21, self.lut_R21_GC[:42]);        # red not use
             
-        self.send_command(0x24);        # bb b
-        self.send_data2(self.lut_R24_GC[:42])
+        self.send_bulk(0x24, self.lut_R24_GC[:42]);        # bb b
         
         if(self.Flag == 0) :
-            self.send_command(0x22);    # bw r
-            self.send_data2(self.lut_R22_GC[:56])
+            self.send_bulk(0x22, self.lut_R22_GC[:56]);    # bw r
                 
-            self.send_command(0x23);    # wb w
-            self.send_data2(self.lut_R23_GC[:42])
+            self.send_bulk(0x23, self.lut_R23_GC[:42]);    # wb w
             self.Flag = 1
 
         else :
-            self.send_command(0x22);    # bw r
-            self.send_data2(self.lut_R23_GC[:56])
+            self.send_bulk(0x22, self.lut_R23_GC[:56]);    # bw r
 
-            self.send_command(0x23);    # wb w
-            self.send_data2(self.lut_R22_GC[:42])
+            self.send_bulk(0x23, self.lut_R22_GC[:42]);    # wb w
             self.Flag = 0
 
     # LUT download        
     def lut_DU(self):
-        self.send_command(0x20);      # vcom
-        self.send_data2(self.lut_R20_DU[:56])
+        self.send_bulk(0x20, self.lut_R20_DU[:56]);      # vcom
             
-        self.send_command(0x21);     # red not use
-        self.send_data2(self.lut_R21_DU[:42])
+        self.send_bulk(0x21, self.lut_R21_DU[:42]);     # red not use
             
-        self.send_command(0x24);    # bb b
-        self.send_data2(self.lut_R24_DU[:42])
+        self.send_bulk(0x24, self.lut_R24_DU[:42]);    # bb b
         
         if(self.Flag == 0) :
-            self.send_command(0x22);      # bw r
-            self.send_data2(self.lut_R22_DU[:56])
+            self.send_bulk(0x22, self.lut_R22_DU[:56]);      # bw r
                 
-            self.send_command(0x23);     # wb w
-            self.send_data2(self.lut_R23_DU[:42])
+            self.send_bulk(0x23, self.lut_R23_DU[:42]);     # wb w
                 
             self.Flag = 1
             
         else :
-            self.send_command(0x22);    # bw r
-            self.send_data2(self.lut_R23_DU[:56])
+            self.send_bulk(0x22, self.lut_R23_DU[:56]);    # bw r
                 
-            self.send_command(0x23);   # wb w
-            self.send_data2(self.lut_R22_DU[:42])
+            self.send_bulk(0x23, self.lut_R22_DU[:42]);   # wb w
                 
             self.Flag = 0
         
@@ -352,100 +339,52 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def display(self, image):
         if (image == None):
             return            
-        self.send_command(0x13);		     # Transfer new data
-        self.send_data2(image)
+        self.send_bulk(0x13, image);		     # Transfer new data
 
     def display_NUM(self, NUM):
-        # pcnt = 0
+        # Test patterns, built row by row and sent in one transfer.
+        linewidth = self.width // 8
+        white = b'\xff' * linewidth
+        black = bytes(linewidth)
+        left_black = bytes(0xFF if row >= linewidth / 2 else 0x00 for row in range(linewidth))
+        right_black = bytes(0x00 if row >= linewidth / 2 else 0xFF for row in range(linewidth))
+        if NUM == self.WHITE:
+            rows = lambda column: white
+        elif NUM == self.BLACK:
+            rows = lambda column: black
+        elif NUM == self.Source_Line:
+            rows = lambda column: b'\xaa' * linewidth
+        elif NUM == self.Gate_Line:
+            # An odd number of Gate line white, the even line Gate black
+            rows = lambda column: white if column % 2 else black
+        elif NUM == self.Chessboard:
+            rows = lambda column: left_black if column >= self.height / 2 else right_black
+        elif NUM == self.LEFT_BLACK_RIGHT_WHITE:
+            rows = lambda column: left_black
+        elif NUM == self.UP_BLACK_DOWN_WHITE:
+            rows = lambda column: white if column >= self.height / 2 else black
+        elif NUM == self.Frame:
+            frame = b'\x7f' + b'\xff' * (linewidth - 2) + b'\xfe'
+            rows = lambda column: black if column == 0 or column == self.height - 1 else frame
+        elif NUM == self.Crosstalk:
+            middle = bytes(0x00 if row >= linewidth / 3 and row <= linewidth / 3 * 2 else 0xFF for row in range(linewidth))
+            rows = lambda column: middle if column <= self.height / 3 or column >= self.height / 3 * 2 else white
+        else:
+            self.send_command(0x13);		     #Transfer new data
+            if NUM == self.Image:
+                # no image is bundled, the original waited 1ms per byte
+                epdconfig.delay_ms(linewidth * self.height)
+                # self.send_data(gImage_1[pcnt++])
+            return
+        self.send_bulk(0x13, b''.join(rows(column) for column in range(self.height)));		     #Transfer new data
 
-        self.send_command(0x13);		     #Transfer new data
-        for column in range(0, self.height):
-            for row in range(0, self.width//8):
-                if NUM == self.WHITE:
-                    self.send_data(0xFF)
-                        
-                elif NUM == self.BLACK:
-                    self.send_data(0x00)
-                        
-                elif NUM == self.Source_Line:
-                    self.send_data(0xAA)
-                        
-                elif NUM == self.Gate_Line:
-                    if(column%2):
-                        self.send_data(0xff) # An odd number of Gate line  
-                    else:
-                        self.send_data(0x00) # The even line Gate  
-                        
-                elif NUM == self.Chessboard:
-                    if(row>=(self.width/8/2) and column>=(self.height/2)):
-                        self.send_data(0xff)
-                    elif(row<(self.width/8/2) and column<(self.height/2)):
-                        self.send_data(0xff)									
-                    else:
-                        self.send_data(0x00)	
-                        
-                elif NUM == self.LEFT_BLACK_RIGHT_WHITE:
-                    if(row>=(self.width/8/2)):
-                        self.send_data(0xff)
-                    else:
-                        self.send_data(0x00)
-                            
-                elif NUM == self.UP_BLACK_DOWN_WHITE:
-                    if(column>=(self.height/2)):
-                        self.send_data(0xFF)
-                    else:
-                        self.send_data(0x00)
-                            
-                elif NUM == self.Frame:
-                    if(column==0 or column==(self.height-1)):
-                        self.send_data(0x00)					
-                    elif(row==0):
-                        self.send_data(0x7F)
-                    elif(row==(self.width/8-1)):
-                        self.send_data(0xFE);					
-                    else:
-                        self.send_data(0xFF);				
-                            
-                elif NUM == self.Crosstalk:
-                    if((row>=(self.width/8/3) and row<=(self.width/8/3*2) and column<=(self.height/3)) or (row>=(self.width/8/3) and row<=(self.width/8/3*2) and column>=(self.height/3*2))):
-                        self.send_data(0x00)
-                    else:
-                        self.send_data(0xFF)				
-                            
-                elif NUM == self.Image:
-                    epdconfig.delay_ms(1)
-                    # self.send_data(gImage_1[pcnt++])
- 
-        
     def Clear(self):
-        self.send_command(0x13);		     # Transfer new data
-        self.send_data2([0xFF] * int(self.width * self.height / 8))
+        self.send_bulk(0x13, epdbuffer.blank(0xFF, int(self.width * self.height / 8)));		     # Transfer new data
         self.lut_GC()
         self.refresh()
 
@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 from PIL import Image
 import RPi.GPIO as GPIO
 
@@ -46,6 +47,9 @@ logger = logging.getLogger(__name__)
 
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -57,7 +61,7 @@ class EPD:
         self.GRAY2 = GRAY2
         self.GRAY3 = GRAY3  # gray
         self.GRAY4 = GRAY4  # Blackest
-        self.DATA = [0x00] * 15000
+        self.DATA = bytearray(int(EPD_WIDTH * EPD_HEIGHT / 8))
 
     lut_vcom0 = [
         0x00, 0x08, 0x08, 0x00, 0x00, 0x02,
@@ -250,62 +254,46 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+
     def ReadBusy(self):
-        self.send_command(0x71)
-        while epdconfig.digital_read(self.busy_pin) == 0:  # 0: idle, 1: busy
-            self.send_command(0x71)
-            epdconfig.delay_ms(100)
+        epdconfig.wait_busy(self.busy_pin, 0, 100, poll=lambda: self.send_command(0x71))      # 0: idle, 1: busy
 
     def set_lut(self):
-        self.send_command(0x20)  # vcom
-        self.send_data2(self.lut_vcom0)
+        self.send_bulk(0x20, self.lut_vcom0)  # vcom
 
-        self.send_command(0x21)  # ww --
-        self.send_data2(self.lut_ww)
+        self.send_bulk(0x21, self.lut_ww)  # ww --
 
-        self.send_command(0x22)  # bw r
-        self.send_data2(self.lut_bw)
+        self.send_bulk(0x22, self.lut_bw)  # bw r
 
-        self.send_command(0x23)  # wb w
-        self.send_data2(self.lut_bb)
+        self.send_bulk(0x23, self.lut_bb)  # wb w
 
-        self.send_command(0x24)  # bb b
-        self.send_data2(self.lut_wb)
+        self.send_bulk(0x24, self.lut_wb)  # bb b
 
     def Partial_SetLut(self):
-        self.send_command(0x20)
-        self.send_data2(self.EPD_4IN2_Partial_lut_vcom1)
+        self.send_bulk(0x20, self.EPD_4IN2_Partial_lut_vcom1)
 
-        self.send_command(0x21)
-        self.send_data2(self.EPD_4IN2_Partial_lut_ww1)
+        self.send_bulk(0x21, self.EPD_4IN2_Partial_lut_ww1)
 
-        self.send_command(0x22)
-        self.send_data2(self.EPD_4IN2_Partial_lut_bw1)
+        self.send_bulk(0x22, self.EPD_4IN2_Partial_lut_bw1)
 
-        self.send_command(0x23)
-        self.send_data2(self.EPD_4IN2_Partial_lut_wb1)
+        self.send_bulk(0x23, self.EPD_4IN2_Partial_lut_wb1)
 
-        self.send_command(0x24)
-        self.send_data2(self.EPD_4IN2_Partial_lut_bb1)
+        self.send_bulk(0x24, self.EPD_4IN2_Partial_lut_bb1)
 
     def Gray_SetLut(self):
-        self.send_command(0x20)  # vcom
-        self.send_data2(self.EPD_4IN2_4Gray_lut_vcom)
+        self.send_bulk(0x20, self.EPD_4IN2_4Gray_lut_vcom)  # vcom
 
-        self.send_command(0x21)  # red not use
-        self.send_data2(self.EPD_4IN2_4Gray_lut_ww)
+        self.send_bulk(0x21, self.EPD_4IN2_4Gray_lut_ww)  # red not use
 
-        self.send_command(0x22)  # bw r
-        self.send_data2(self.EPD_4IN2_4Gray_lut_bw)
+        self.send_bulk(0x22, self.EPD_4IN2_4Gray_lut_bw)  # bw r
 
-        self.send_command(0x23)  # wb w
-        self.send_data2(self.EPD_4IN2_4Gray_lut_wb)
+        self.send_bulk(0x23, self.EPD_4IN2_4Gray_lut_wb)  # wb w
 
-        self.send_command(0x24)  # bb b
-        self.send_data2(self.EPD_4IN2_4Gray_lut_bb)
+        self.send_bulk(0x24, self.EPD_4IN2_4Gray_lut_bb)  # bb b
 
-        self.send_command(0x25)  # vcom
-        self.send_data2(self.EPD_4IN2_4Gray_lut_ww)
+        self.send_bulk(0x25, self.EPD_4IN2_4Gray_lut_ww)  # vcom
 
     def init(self):
         if epdconfig.module_init() != 0:
@@ -433,69 +421,10 @@ class EPD:
         self.send_data(0x97)
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if imwidth == self.width and imheight == self.height:
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif imwidth == self.height and imheight == self.width:
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy * self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
 
     def getbuffer_4Gray(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 4) * self.height)
-        image_monocolor = image.convert('L')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        i = 0
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if imwidth == self.width and imheight == self.height:
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0xC0:
-                        pixels[x, y] = 0x80
-                    elif pixels[x, y] == 0x80:
-                        pixels[x, y] = 0x40
-                    i = i + 1
-                    if i % 4 == 0:
-                        buf[int((x + (y * self.width)) / 4)] = (
-                                    (pixels[x - 3, y] & 0xc0) | (pixels[x - 2, y] & 0xc0) >> 2 | (
-                                        pixels[x - 1, y] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
-
-        elif imwidth == self.height and imheight == self.width:
-            logger.debug("Horizontal")
-            for x in range(imwidth):
-                for y in range(imheight):
-                    newx = y
-                    newy = x
-                    if pixels[x, y] == 0xC0:
-                        pixels[x, y] = 0x80
-                    elif pixels[x, y] == 0x80:
-                        pixels[x, y] = 0x40
-                    i = i + 1
-                    if i % 4 == 0:
-                        buf[int((newx + (newy * self.width)) / 4)] = (
-                                    (pixels[x, y - 3] & 0xc0) | (pixels[x, y - 2] & 0xc0) >> 2 | (
-                                        pixels[x, y - 1] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
-
-        return buf
+        return epdbuffer.pack_4gray(image, self.width, self.height, Image.Transpose.TRANSPOSE)
 
     def display(self, image):
         if self.width % 8 == 0:
@@ -505,11 +434,9 @@ class EPD:
 
         self.send_command(0x92)
         self.set_lut()
-        self.send_command(0x10)
-        self.send_data2([0xFF] * int(self.width * linewidth))
+        self.send_bulk(0x10, epdbuffer.blank(0xFF, int(self.width * linewidth)))
 
-        self.send_command(0x13)
-        self.send_data2(image)
+        self.send_bulk(0x13, image)
 
         self.send_command(0x12)
         self.ReadBusy()
@@ -522,128 +449,45 @@ class EPD:
             Width = int(EPD_WIDTH / 8) + 1
         else:
             Width = int(EPD_WIDTH / 8)
-        Height = EPD_HEIGHT
-
-        if X_start % 8 != 0:
-            X_start = int(X_start / 8) + 1
-        else:
-            X_start = int(X_start / 8)
-        if X_end % 8 != 0:
-            X_end = int(X_end / 8) + 1
-        else:
-            X_end = int(X_end / 8)
 
-        buf = [0x00] * (Y_end - Y_start) * (X_end - X_start)
+        # window in bytes, rounded out to cover X_start..X_end
+        X_start = X_start // 8
+        X_end = (X_end + 7) // 8
 
         self.send_command(0x91)  # This command makes the display enter partial mode
-        self.send_command(0x90)  # resolution setting
-        self.send_data(int(X_start * 8 / 256))
-        self.send_data(int(X_start * 8 % 256))  # x-start
-
-        self.send_data(int(X_end * 8 / 256))
-        self.send_data(int(X_end * 8 % 256) - 1)  # x-end
-
-        self.send_data(int(Y_start / 256))
-        self.send_data(int(Y_start % 256))  # y-start
-
-        self.send_data(int(Y_end / 256))
-        self.send_data(int(Y_end % 256) - 1)  # y-end
-        self.send_data(0x28)
-
-        self.send_command(0x10)  # writes Old data to SRAM for programming
+        self.send_bulk(0x90, [  # resolution setting
+            X_start * 8 // 256, X_start * 8 % 256,  # x-start
+            (X_end * 8 - 1) // 256, (X_end * 8 - 1) % 256,  # x-end
+            Y_start // 256, Y_start % 256,  # y-start
+            (Y_end - 1) // 256, (Y_end - 1) % 256,  # y-end
+            0x28])
+
+        # partial mode uses inverted data, self.DATA holds what the panel shows
+        buf = epdbuffer.invert(epdbuffer.window(Image, Width, X_start, Y_start, X_end, Y_end))
+        self.send_bulk(0x10, epdbuffer.window(self.DATA, Width, X_start, Y_start, X_end, Y_end))  # writes Old data to SRAM for programming
+        self.send_bulk(0x13, buf)  # writes New data to SRAM.
+
+        rowwidth = X_end - X_start
         for j in range(0, Y_end - Y_start):
-            for i in range(0, X_end - X_start):
-                buf[j * (X_end - X_start) + i] = self.DATA[(Y_start + j) * Width + X_start + i]
-        self.send_data2(buf)
-
-        self.send_command(0x13)  # writes New data to SRAM.
-        for j in range(0, Y_end - Y_start):
-            for i in range(0, X_end - X_start):
-                buf[j * (X_end - X_start) + i] = ~Image[(Y_start + j) * Width + X_start + i]
-                self.DATA[(Y_start + j) * Width + X_start + i] = ~Image[(Y_start + j) * Width + X_start / 8 + i]
-        self.send_data2(buf)
+            self.DATA[(Y_start + j) * Width + X_start:(Y_start + j) * Width + X_end] = buf[j * rowwidth:(j + 1) * rowwidth]
 
         self.send_command(0x12)  # DISPLAY REFRESH
         epdconfig.delay_ms(200)  # The delay here is necessary, 200uS at least!!!
         self.ReadBusy()
 
+    # Refreshes the window [x0, x1) x [y0, y1) of buffer with the partial waveform, old is the frame shown now.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        if old is not None:
+            self.DATA = epdbuffer.invert(old)
+        self.init_Partial()
+        self.EPD_4IN2_PartialDisplay(x0, y0, x1, y1, buffer)
+
     def display_4Gray(self, image):
         self.send_command(0x92)
         self.set_lut()
-        self.send_command(0x10)
-
-        if self.width % 8 == 0:
-            linewidth = int(self.width / 8)
-        else:
-            linewidth = int(self.width / 8) + 1
+        self.send_bulk(0x10, epdbuffer.bitplane(image, self.width, self.height, (0, 0, 1, 1)))
 
-        buf = [0x00] * self.height * linewidth
-
-        for i in range(0, int(EPD_WIDTH * EPD_HEIGHT / 8)):  # EPD_WIDTH * EPD_HEIGHT / 4
-            temp3 = 0
-            for j in range(0, 2):
-                temp1 = image[i * 2 + j]
-                for k in range(0, 2):
-                    temp2 = temp1 & 0xC0
-                    if temp2 == 0xC0:
-                        temp3 |= 0x01  # white
-                    elif temp2 == 0x00:
-                        temp3 |= 0x00  # black
-                    elif temp2 == 0x80:
-                        temp3 |= 0x01  # gray1
-                    else:  # 0x40
-                        temp3 |= 0x00  # gray2
-                    temp3 <<= 1
-
-                    temp1 <<= 2
-                    temp2 = temp1 & 0xC0
-                    if temp2 == 0xC0:  # white
-                        temp3 |= 0x01
-                    elif temp2 == 0x00:  # black
-                        temp3 |= 0x00
-                    elif temp2 == 0x80:
-                        temp3 |= 0x01  # gray1
-                    else:  # 0x40
-                        temp3 |= 0x00  # gray2
-                    if j != 1 or k != 1:
-                        temp3 <<= 1
-                    temp1 <<= 2
-            buf[i] = temp3
-        self.send_data2(buf)
-
-        self.send_command(0x13)
-
-        for i in range(0, int(EPD_WIDTH * EPD_HEIGHT / 8)):  # 5808*4  46464
-            temp3 = 0
-            for j in range(0, 2):
-                temp1 = image[i * 2 + j]
-                for k in range(0, 2):
-                    temp2 = temp1 & 0xC0
-                    if temp2 == 0xC0:
-                        temp3 |= 0x01  # white
-                    elif temp2 == 0x00:
-                        temp3 |= 0x00  # black
-                    elif temp2 == 0x80:
-                        temp3 |= 0x00  # gray1
-                    else:  # 0x40
-                        temp3 |= 0x01  # gray2
-                    temp3 <<= 1
-
-                    temp1 <<= 2
-                    temp2 = temp1 & 0xC0
-                    if temp2 == 0xC0:  # white
-                        temp3 |= 0x01
-                    elif temp2 == 0x00:  # black
-                        temp3 |= 0x00
-                    elif temp2 == 0x80:
-                        temp3 |= 0x00  # gray1
-                    else:  # 0x40
-                        temp3 |= 0x01  # gray2
-                    if j != 1 or k != 1:
-                        temp3 <<= 1
-                    temp1 <<= 2
-            buf[i] = temp3
-        self.send_data2(buf)
+        self.send_bulk(0x13, epdbuffer.bitplane(image, self.width, self.height, (0, 1, 0, 1)))
 
         self.Gray_SetLut()
         self.send_command(0x12)
@@ -657,11 +501,9 @@ class EPD:
         else:
             linewidth = int(self.width / 8) + 1
 
-        self.send_command(0x10)
-        self.send_data2([0xff] * int(self.height * linewidth))
+        self.send_bulk(0x10, epdbuffer.blank(0xff, int(self.height * linewidth)))
 
-        self.send_command(0x13)
-        self.send_data2([0xff] * int(self.height * linewidth))
+        self.send_bulk(0x13, epdbuffer.blank(0xff, int(self.height * linewidth)))
 
         self.send_command(0x12)
         self.ReadBusy()
@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 600
@@ -37,7 +38,16 @@ EPD_HEIGHT      = 448
 
 logger = logging.getLogger(__name__)
 
+# 4-bit panel code of every 2-bit pixel code: black 0b00 -> 0x0, white 0b11 -> 0x3, gray -> 0x4
+PANEL_CODES = (0x00, 0x04, 0x04, 0x03)
+# Panel codes of pixels 0-1 and 2-3 of every 2bpp byte, used with bytes.translate.
+DISPLAY_HIGH_TABLE = bytes(PANEL_CODES[b >> 6] << 4 | PANEL_CODES[b >> 4 & 3] for b in range(256))
+DISPLAY_LOW_TABLE = bytes(PANEL_CODES[b >> 2 & 3] << 4 | PANEL_CODES[b & 3] for b in range(256))
+
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -67,10 +77,12 @@ class EPD:
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)    
+        epdconfig.wait_busy(self.busy_pin, 0, 100)      # 0: idle, 1: busy
         logger.debug("e-Paper busy release")
         
     def init(self):
@@ -123,70 +135,27 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        buf = [0x00] * int(self.width * self.height / 4)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        logger.debug('imwidth = %d  imheight =  %d ',imwidth, imheight)
-        if(imwidth == self.width and imheight == self.height):
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] < 64:           # black
-                        buf[int((x + y * self.width) / 4)] &= ~(0xC0 >> (x % 4 * 2))
-                    elif pixels[x, y] < 192:     # convert gray to red
-                        buf[int((x + y * self.width) / 4)] &= ~(0xC0 >> (x % 4 * 2))
-                        buf[int((x + y * self.width) / 4)] |= 0x40 >> (x % 4 * 2)
-                    else:                           # white
-                        buf[int((x + y * self.width) / 4)] |= 0xC0 >> (x % 4 * 2)
-        elif(imwidth == self.height and imheight == self.width):
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1                    
-                    if pixels[x, y] < 64:           # black
-                        buf[int((newx + newy*self.width) / 4)] &= ~(0xC0 >> (y % 4 * 2))
-                    elif pixels[x, y] < 192:     # convert gray to red
-                        buf[int((newx + newy*self.width) / 4)] &= ~(0xC0 >> (y % 4 * 2))
-                        buf[int((newx + newy*self.width) / 4)] |= 0x40 >> (y % 4 * 2)
-                    else:                           # white
-                        buf[int((newx + newy*self.width) / 4)] |= 0xC0 >> (y % 4 * 2)
-        return buf
+        img = epdbuffer.orient(image, self.width, self.height, '1')
+        if img is None:
+            return bytearray(int(self.width * self.height / 4))
+        # 2 bits per pixel: black 0b00, gray (shown as red) 0b01, white 0b11
+        lut = [0x00] * 64 + [0x01] * 128 + [0x03] * 64
+        return epdbuffer.pack_codes(img, lut, 2)
 
     def display(self, image):
-        self.send_command(0x10)
-        for i in range(0, int(self.width / 4 * self.height)):
-            temp1 = image[i]
-            j = 0
-            while (j < 4):
-                if ((temp1 & 0xC0) == 0xC0):
-                    temp2 = 0x03
-                elif ((temp1 & 0xC0) == 0x00):
-                    temp2 = 0x00
-                else:
-                    temp2 = 0x04
-                temp2 = (temp2 << 4) & 0xFF
-                temp1 = (temp1 << 2) & 0xFF
-                j += 1
-                if((temp1 & 0xC0) == 0xC0):
-                    temp2 |= 0x03
-                elif ((temp1 & 0xC0) == 0x00):
-                    temp2 |= 0x00
-                else:
-                    temp2 |= 0x04
-                temp1 = (temp1 << 2) & 0xFF
-                self.send_data(temp2)
-                j += 1
+        # Every 2bpp input byte becomes two bytes of 4bpp panel codes, high and low half each looked up in a table.
+        image = bytes(image[0:int(self.width / 4 * self.height)])
+        buf = bytearray(len(image) * 2)
+        buf[0::2] = image.translate(DISPLAY_HIGH_TABLE)
+        buf[1::2] = image.translate(DISPLAY_LOW_TABLE)
+        self.send_bulk(0x10, buf)
                 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
         self.ReadBusy()
         
     def Clear(self):
-        self.send_command(0x10)
-        for i in range(0, int(self.width / 4 * self.height)):
-            for j in range(0, 4):
-                self.send_data(0x33)
+        self.send_bulk(0x10, epdbuffer.blank(0x33, int(self.width / 4 * self.height) * 4))
         self.send_command(0x12)
         self.ReadBusy()
 
@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 640
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 384
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -73,10 +77,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)    
+        epdconfig.wait_busy(self.busy_pin, 0, 100)      # 0: idle, 1: busy
         logger.debug("e-Paper busy release")
         
     def init(self):
@@ -85,14 +91,11 @@ class EPD:
         # EPD hardware init start
         self.reset()
         
-        self.send_command(0x01) # POWER_SETTING
-        self.send_data2([0x37, 0x00])
+        self.send_bulk(0x01, [0x37, 0x00]) # POWER_SETTING
         
-        self.send_command(0x00) # PANEL_SETTING
-        self.send_data2([0xCF, 0x08])
+        self.send_bulk(0x00, [0xCF, 0x08]) # PANEL_SETTING
         
-        self.send_command(0x06) # BOOSTER_SOFT_START
-        self.send_data2([0xc7, 0xcc, 0x28])
+        self.send_bulk(0x06, [0xc7, 0xcc, 0x28]) # BOOSTER_SOFT_START
         
         self.send_command(0x04) # POWER_ON
         self.ReadBusy()
@@ -125,50 +128,23 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        halfwidth = int(self.width / 2)
-        buf = [0x33] * halfwidth * self.height
-        
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            img = img.rotate(90, expand=True).convert('1')
-            imwidth, imheight = img.size
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
+        img = epdbuffer.orient(image, self.width, self.height, '1', rotate_first=True)
+        if img is None:
             # return a blank buffer
-            return buf
-        
-        pixels = img.load()
-
-        for y in range(imheight):
-            offset = y * halfwidth
-            for x in range(1, imwidth, 2):
-                i = offset + x // 2
-                if(pixels[x-1, y] > 191):
-                    if(pixels[x, y] > 191):
-                        buf[i] = 0x33
-                    else:
-                        buf[i] = 0x30
-                else:
-                    if(pixels[x, y] > 191):
-                        buf[i] = 0x03
-                    else:
-                        buf[i] = 0x00
-        return buf
+            return bytearray([0x33]) * (int(self.width / 2) * self.height)
+        # 4 bits per pixel: white 0x3, black 0x0
+        lut = [0x00] * 192 + [0x03] * 64
+        return epdbuffer.pack_codes(img, lut, 4)
         
     def display(self, image):
-        self.send_command(0x10)
-        self.send_data2(image)
+        self.send_bulk(0x10, image)
         self.send_command(0x12)
         epdconfig.delay_ms(100)
         self.ReadBusy()
         
     def Clear(self):
-        buf = [0x33] * int(self.width * self.height / 2)
-        self.send_command(0x10)
-        self.send_data2(buf)
+        buf = epdbuffer.blank(0x33, int(self.width * self.height / 2))
+        self.send_bulk(0x10, buf)
         self.send_command(0x12)
         self.ReadBusy()
 
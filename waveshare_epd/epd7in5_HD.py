@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 880
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 528
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = False
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -73,11 +77,12 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+        
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        busy = epdconfig.digital_read(self.busy_pin)
-        while(busy == 1):
-            busy = epdconfig.digital_read(self.busy_pin)
+        epdconfig.wait_busy(self.busy_pin, 1, 10)
         epdconfig.delay_ms(200)
         
     def init(self):
@@ -108,8 +113,7 @@ class EPD:
 
         self.send_command(0x44); 
         self.send_data2([0x00, 0x00, 0x6F, 0x03]) # RAM x address start at 0
-        self.send_command(0x45); 
-        self.send_data2([0xAF, 0x02, 0x00, 0x00])
+        self.send_bulk(0x45, [0xAF, 0x02, 0x00, 0x00])
 
         self.send_command(0x3C); # VBD
         self.send_data(0x05); # LUT1, for white
@@ -125,31 +129,16 @@ class EPD:
 
         self.send_command(0x4E); # set RAM x address count to 0;
         self.send_data2([0x00, 0x00])
-        self.send_command(0x4F); 
-        self.send_data2([0x00, 0x00])
+        self.send_bulk(0x4F, [0x00, 0x00])
         # EPD hardware init end
         return 0
 
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            img = img.rotate(90, expand=True).convert('1')
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return [0xff] * int(self.width * self.height / 8)
-
-        buf = bytearray(img.tobytes('raw'))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height, rotate_first=True)
         
     def display(self, image):
-        self.send_command(0x4F); 
-        self.send_data2([0x00, 0x00])
-        self.send_command(0x24);
-        self.send_data2(image)
+        self.send_bulk(0x4F, [0x00, 0x00])
+        self.send_bulk(0x24, image)
         self.send_command(0x22);
         self.send_data(0xF7);#Load LUT from MCU(0x32)
         self.send_command(0x20);
@@ -157,14 +146,11 @@ class EPD:
         self.ReadBusy();
         
     def Clear(self):
-        buf = [0xff] * int(self.width * self.height / 8)
-        self.send_command(0x4F); 
-        self.send_data2([0x00, 0x00])
-        self.send_command(0x24)
-        self.send_data2(buf)
+        buf = epdbuffer.blank(0xff, int(self.width * self.height / 8))
+        self.send_bulk(0x4F, [0x00, 0x00])
+        self.send_bulk(0x24, buf)
             
-        self.send_command(0x26)
-        self.send_data2(buf)
+        self.send_bulk(0x26, buf)
                 
         self.send_command(0x22);
         self.send_data(0xF7);#Load LUT from MCU(0x32)
@@ -30,6 +30,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 800
@@ -38,6 +39,9 @@ EPD_HEIGHT      = 480
 logger = logging.getLogger(__name__)
 
 class EPD:
+    # whether update_region is available
+    PARTIAL_REFRESH = True
+
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
@@ -127,36 +131,25 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
+    def send_bulk(self, command, data):
+        epdconfig.send_bulk(self.dc_pin, self.cs_pin, command, data)
+
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        while(busy == 0):
-            self.send_command(0x71)
-            busy = epdconfig.digital_read(self.busy_pin)
+        epdconfig.wait_busy(self.busy_pin, 0, 10, poll=lambda: self.send_command(0x71))
         epdconfig.delay_ms(20)
         logger.debug("e-Paper busy release")
         
     def SetLut(self, lut_vcom, lut_ww, lut_bw, lut_wb, lut_bb):
-        self.send_command(0x20)
-        for count in range(0, 42):
-            self.send_data(lut_vcom[count])
+        self.send_bulk(0x20, lut_vcom[0:42])
 
-        self.send_command(0x21)
-        for count in range(0, 42):
-            self.send_data(lut_ww[count])
+        self.send_bulk(0x21, lut_ww[0:42])
 
-        self.send_command(0x22)
-        for count in range(0, 42):
-            self.send_data(lut_bw[count])
+        self.send_bulk(0x22, lut_bw[0:42])
 
-        self.send_command(0x23)
-        for count in range(0, 42):
-            self.send_data(lut_wb[count])
+        self.send_bulk(0x23, lut_wb[0:42])
 
-        self.send_command(0x24)
-        for count in range(0, 42):
-            self.send_data(lut_bb[count])
+        self.send_bulk(0x24, lut_bb[0:42])
 
     def init(self):
         if (epdconfig.module_init() != 0):
@@ -228,40 +221,72 @@ class EPD:
         # EPD hardware init end
         return 0
 
+    def init_part(self):
+        if (epdconfig.module_init() != 0):
+            return -1
+        # EPD hardware init start
+        self.reset()
+
+        self.send_command(0X00)     # PANNEL SETTING
+        self.send_data(0x1F)        # KW-3f KWR-2F BWROTP-0f BWOTP-1f
+
+        self.send_command(0x04)     # POWER ON
+        epdconfig.delay_ms(100)
+        self.ReadBusy()
+
+        self.send_command(0xE0)     # Cascade setting, fixed temperature
+        self.send_data(0x02)
+        self.send_command(0xE5)     # Force temperature, selects the fast waveform
+        self.send_data(0x6E)
+
+        # EPD hardware init end
+        return 0
+
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return [0x00] * (int(self.width/8) * self.height)
-
-        buf = bytearray(img.tobytes('raw'))
-        # The bytes need to be inverted, because in the PIL world 0=black and 1=white, but
-        # in the e-paper world 0=white and 1=black.
-        for i in range(len(buf)):
-            buf[i] ^= 0xFF
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height, inverted=True, rotate_first=True)
 
     def display(self, image):
-        self.send_command(0x13)
-        self.send_data2(image)
+        self.send_bulk(0x13, image)
+
+        self.send_command(0x12)
+        epdconfig.delay_ms(100)
+        self.ReadBusy()
+
+    # Refreshes only the window [Xstart, Xend) x [Ystart, Yend) of image, a full frame from getbuffer.
+    # Xstart and Xend are rounded out to multiples of 8. old is the frame currently shown: the panel
+    # loses its old data RAM in deep sleep and the partial waveform needs it.
+    def display_Partial(self, image, Xstart, Ystart, Xend, Yend, old=None):
+        linewidth = int(self.width / 8)
+        Xstart = Xstart // 8 * 8
+        Xend = (Xend + 7) // 8 * 8
+
+        self.send_command(0X50)     # VCOM AND DATA INTERVAL SETTING
+        self.send_data(0xA9)
+        self.send_data(0x07)
+
+        self.send_command(0x91)     # Partial in
+        self.send_bulk(0x90, [      # Partial window
+            Xstart // 256, Xstart % 256, (Xend - 1) // 256, (Xend - 1) % 256,
+            Ystart // 256, Ystart % 256, (Yend - 1) // 256, (Yend - 1) % 256,
+            0x01])
+
+        if old is not None:
+            self.send_bulk(0x10, epdbuffer.window(old, linewidth, Xstart // 8, Ystart, Xend // 8, Yend))
+        self.send_bulk(0x13, epdbuffer.window(image, linewidth, Xstart // 8, Ystart, Xend // 8, Yend))
 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
         self.ReadBusy()
 
+    # Refreshes the window [x0, x1) x [y0, y1) of buffer with the partial waveform, old is the frame shown now.
+    def update_region(self, buffer, x0, y0, x1, y1, old=None):
+        self.init_part()
+        self.display_Partial(buffer, x0, y0, x1, y1, old)
+
     def Clear(self):
-        buf = [0x00] * (int(self.width/8) * self.height)
-        self.send_command(0x10)
-        self.send_data2(buf)
-        self.send_command(0x13)
-        self.send_data2(buf)
+        buf = epdbuffer.blank(0x00, int(self.width/8) * self.height)
+        self.send_bulk(0x10, buf)
+        self.send_bulk(0x13, buf)
         self.send_command(0x12)
         epdconfig.delay_ms(100)
         self.ReadBusy()
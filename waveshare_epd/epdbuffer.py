@@ -0,0 +1,159 @@
+import functools
+import logging
+from PIL import Image, ImageChops
+
+logger = logging.getLogger(__name__)
+
+# Lookup table flipping every bit of a byte, used with bytes.translate.
+INVERT_TABLE = bytes(0xFF ^ i for i in range(256))
+
+# 2-bit codes of the 4 gray levels: 0 black, 1 gray2, 2 gray1, 3 white. Pixel values 0x80 and 0xC0
+# map to gray2 and gray1, any other value keeps its two most significant bits.
+GRAY4_LUT = [i >> 6 for i in range(256)]
+GRAY4_LUT[0x80] = 0x01
+GRAY4_LUT[0xC0] = 0x02
+
+# The 7 colors of ACeP panels, in the order of their 4-bit codes.
+ACEP_7COLOR = (0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0)
+
+
+def invert(buf):
+    # In the PIL world 0=black and 1=white, on some panels 0=white and 1=black.
+    return bytearray(buf).translate(INVERT_TABLE)
+
+
+def orient(image, width, height, mode, rotation=Image.Transpose.ROTATE_90, rotate_first=False):
+    # Converts image to mode, applying rotation when its dimensions are swapped.
+    # Returns None when image does not fit the panel in any orientation.
+    # Dithering to '1' depends on the scan direction, so rotate_first decides whether the image is
+    # rotated before or after the conversion, to keep each driver's original output.
+    if image.size == (width, height):
+        return image.convert(mode)
+    elif image.size == (height, width):
+        # image has correct dimensions, but needs to be rotated
+        if rotate_first:
+            return image.transpose(rotation).convert(mode)
+        return image.convert(mode).transpose(rotation)
+    logger.warning("Wrong image dimensions: must be " + str(width) + "x" + str(height))
+    return None
+
+
+def tobytes_1bpp(img, linewidth, white_padding=True):
+    # Packs mode '1' image MSB first, padding every row to linewidth bytes with white pixels,
+    # or with the zero bits of Image.tobytes when white_padding is False.
+    if white_padding and img.width != linewidth * 8:
+        canvas = Image.new('1', (linewidth * 8, img.height), 255)
+        canvas.paste(img, (0, 0))
+        img = canvas
+    return bytearray(img.tobytes('raw', '1'))
+
+
+def pack_1bpp(image, width, height, inverted=False, rotate_first=False, white_padding=True):
+    # Packs image into an MSB-first 1bpp buffer of width x height, rows padded to full bytes.
+    linewidth = (width + 7) // 8
+    img = orient(image, width, height, '1', rotate_first=rotate_first)
+    if img is None:
+        # return a blank buffer
+        return bytearray([0x00 if inverted else 0xFF]) * (linewidth * height)
+
+    buf = tobytes_1bpp(img, linewidth, white_padding)
+    if inverted:
+        return buf.translate(INVERT_TABLE)
+    return buf
+
+
+def pack_codes(img, lut, bits):
+    # Maps every pixel of a mode 'L' or '1' image through lut (256 entries) and packs
+    # the resulting codes with 2 or 4 bits per pixel, first pixel in the high bits.
+    if img.mode != 'L':
+        img = img.convert('L')
+    codes = img.point(lut)
+    return bytearray(Image.frombytes('P', codes.size, codes.tobytes()).tobytes('raw', 'P;' + str(bits)))
+
+
+def pack_4gray(image, width, height, rotation=Image.Transpose.ROTATE_90):
+    # Quantizes image to 4 gray levels and packs them with 2 bits per pixel.
+    img = orient(image, width, height, 'L', rotation)
+    if img is None:
+        return bytearray([0xFF]) * (int(width / 4) * height)
+    return pack_codes(img, GRAY4_LUT, 2)
+
+
+def bitplane(buf, width, height, bits):
+    # Extracts a 1bpp plane from a 2 bits per pixel buffer, bits maps each of the 4 codes to 0 or 1.
+    codes = Image.frombytes('L', (width, height), bytes(buf), 'raw', 'L;2')
+    lut = [0] * 256
+    for code, bit in enumerate(bits):
+        # L;2 unpacks code c to c * 0x55
+        lut[code * 0x55] = 255 if bit else 0
+    return tobytes_1bpp(codes.point(lut, '1'), (width + 7) // 8)
+
+
+def pack_planes(width, height, codes, bits, black, red=None):
+    # Packs 1bpp black and optional red planes into color codes with bits per pixel.
+    # codes is (black, white[, red]), a cleared red bit wins over the black plane.
+    size = (width, height)
+    n = ((width + 7) // 8) * height
+    img = Image.frombytes('1', size, bytes(black[0:n])).convert('L')
+    img = img.point([codes[0]] * 255 + [codes[1]])
+    if red is not None:
+        mask = Image.frombytes('1', size, bytes(red[0:n]))
+        img = Image.composite(img, Image.new('L', size, codes[2]), mask)
+    return bytearray(Image.frombytes('P', size, img.tobytes()).tobytes('raw', 'P;' + str(bits)))
+
+
+def changed_region(old, new, width, height, boxes=None):
+    # Bounding box (x0, y0, x1, y1), ends exclusive, of the pixels that differ between two packed
+    # 1bpp frames of the same polarity. x is rounded out to whole bytes. None when nothing changed.
+    # boxes limits the comparison to these pixel boxes, e.g. the parts of the frame that were redrawn.
+    if old == new:
+        return None
+    linewidth = (width + 7) // 8
+    if boxes is None:
+        boxes = [(0, 0, linewidth * 8, height)]
+    region = None
+    for x0, y0, x1, y1 in boxes:
+        x0, x1 = x0 // 8, min((x1 + 7) // 8, linewidth)
+        a = window(old, linewidth, x0, y0, x1, y1)
+        b = window(new, linewidth, x0, y0, x1, y1)
+        if a == b:
+            continue
+        size = ((x1 - x0) * 8, y1 - y0)
+        box = ImageChops.logical_xor(Image.frombytes('1', size, bytes(a)), Image.frombytes('1', size, bytes(b))).getbbox()
+        if box is None:
+            continue
+        box = (x0 * 8 + box[0] // 8 * 8, y0 + box[1], x0 * 8 + (box[2] + 7) // 8 * 8, y0 + box[3])
+        if region is not None:
+            box = (min(region[0], box[0]), min(region[1], box[1]), max(region[2], box[2]), max(region[3], box[3]))
+        region = box
+    return region
+
+
+def window(buf, linewidth, x0, y0, x1, y1):
+    # Bytes x0..x1 of rows y0..y1 (ends exclusive) of a packed frame, rows concatenated.
+    view = memoryview(buf)
+    if x0 == 0 and x1 == linewidth:
+        return view[y0 * linewidth:y1 * linewidth]
+    return b''.join(view[y * linewidth + x0:y * linewidth + x1] for y in range(y0, y1))
+
+
+@functools.lru_cache(maxsize=16)
+def blank(value, size):
+    # Immutable buffer of size bytes set to value, shared between calls.
+    return bytes([value]) * size
+
+
+def palette_image(colors):
+    # Palette image used to quantize frames to the colors supported by a panel.
+    pal_image = Image.new("P", (1,1))
+    pal_image.putpalette(tuple(colors) + (0,0,0) * (256 - len(colors) // 3))
+    return pal_image
+
+
+def pack_palette(image, width, height, pal_image, bits):
+    # Quantizes image to the colors of pal_image, dithering if needed, and packs
+    # the color codes with bits per pixel. Returns None on wrong image dimensions.
+    img = orient(image, width, height, 'RGB')
+    if img is None:
+        return None
+    return img.quantize(palette=pal_image).tobytes('raw', 'P;' + str(bits))
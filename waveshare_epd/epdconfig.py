@@ -35,6 +35,15 @@ import time
 logger = logging.getLogger(__name__)
 
 
+def spidev_bufsiz(default=4096):
+    # Largest transfer the spidev kernel driver accepts at once.
+    try:
+        with open('/sys/module/spidev/parameters/bufsiz') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return default
+
+
 class RaspberryPi:
     # Pin definition
     RST_PIN  = 17
@@ -43,12 +52,18 @@ class RaspberryPi:
     BUSY_PIN = 24
     PWR_PIN  = 18
 
+    # SPI definition
+    SPI_BUS    = 0
+    SPI_DEVICE = 0
+    SPI_SPEED  = 4000000
+
     def __init__(self):
         import spidev
         import RPi.GPIO
 
         self.GPIO = RPi.GPIO
         self.SPI = spidev.SpiDev()
+        self.SPI_CHUNK = spidev_bufsiz()
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -56,6 +71,10 @@ class RaspberryPi:
     def digital_read(self, pin):
         return self.GPIO.input(pin)
 
+    def wait_for_edge(self, pin, rising, timeout_ms):
+        edge = self.GPIO.RISING if rising else self.GPIO.FALLING
+        return self.GPIO.wait_for_edge(pin, edge, timeout=int(timeout_ms)) is not None
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -63,7 +82,14 @@ class RaspberryPi:
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            # lists are converted and split by spidev itself
+            self.SPI.writebytes2(data)
+            return
+        # stream buffers in kernel sized chunks without copying them
+        view = memoryview(data)
+        for start in range(0, len(view), self.SPI_CHUNK):
+            self.SPI.writebytes2(view[start:start + self.SPI_CHUNK])
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -76,9 +102,8 @@ class RaspberryPi:
         
         self.GPIO.output(self.PWR_PIN, 1)
 
-        # SPI device, bus = 0, device = 0
-        self.SPI.open(0, 0)
-        self.SPI.max_speed_hz = 4000000
+        self.SPI.open(self.SPI_BUS, self.SPI_DEVICE)
+        self.SPI.max_speed_hz = self.SPI_SPEED
         self.SPI.mode = 0b00
         return 0
 
@@ -127,6 +152,10 @@ class JetsonNano:
     def digital_read(self, pin):
         return self.GPIO.input(self.BUSY_PIN)
 
+    def wait_for_edge(self, pin, rising, timeout_ms):
+        edge = self.GPIO.RISING if rising else self.GPIO.FALLING
+        return self.GPIO.wait_for_edge(pin, edge, timeout=int(timeout_ms)) is not None
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -172,6 +201,11 @@ class SunriseX3:
     PWR_PIN  = 18
     Flag     = 0
 
+    # SPI definition
+    SPI_BUS    = 2
+    SPI_DEVICE = 0
+    SPI_SPEED  = 4000000
+
     def __init__(self):
         import spidev
         import Hobot.GPIO
@@ -185,6 +219,10 @@ class SunriseX3:
     def digital_read(self, pin):
         return self.GPIO.input(pin)
 
+    def wait_for_edge(self, pin, rising, timeout_ms):
+        edge = self.GPIO.RISING if rising else self.GPIO.FALLING
+        return self.GPIO.wait_for_edge(pin, edge, timeout=int(timeout_ms)) is not None
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -209,9 +247,8 @@ class SunriseX3:
 
             self.GPIO.output(self.PWR_PIN, 1)
         
-            # SPI device, bus = 0, device = 0
-            self.SPI.open(2, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.open(self.SPI_BUS, self.SPI_DEVICE)
+            self.SPI.max_speed_hz = self.SPI_SPEED
             self.SPI.mode = 0b00
             return 0
         else:
@@ -240,4 +277,60 @@ else:
 for func in [x for x in dir(implementation) if not x.startswith('_')]:
     setattr(sys.modules[__name__], func, getattr(implementation, func))
 
+
+# Longest time a panel may stay busy, None waits forever.
+busy_timeout_ms = 60000
+# Edge detection is waited for in slices, so an edge missed before the wait started costs at most one slice.
+EDGE_SLICE_MS = 100
+_edge_detection = True
+
+
+def configure(spi_bus=None, spi_device=None, spi_speed=None, busy_timeout=None):
+    # Overrides the SPI bus, device and clock used by the next module_init and the busy timeout in ms.
+    # The software SPI of JetsonNano ignores the SPI settings.
+    global busy_timeout_ms
+    if busy_timeout is not None:
+        busy_timeout_ms = busy_timeout
+    if spi_bus is not None:
+        implementation.SPI_BUS = spi_bus
+    if spi_device is not None:
+        implementation.SPI_DEVICE = spi_device
+    if spi_speed is not None:
+        implementation.SPI_SPEED = spi_speed
+
+
+def wait_busy(pin, busy_level, poll_ms=10, poll=None):
+    # Blocks while pin reads busy_level. Sleeps on GPIO edge detection when the GPIO library
+    # supports it, otherwise reads the pin every poll_ms. poll is called before every wait,
+    # for panels that need a status command to refresh their BUSY line.
+    # Raises TimeoutError when the panel is still busy after busy_timeout_ms.
+    global _edge_detection
+    start = time.monotonic()
+    while True:
+        if poll is not None:
+            poll()
+        if digital_read(pin) != busy_level:
+            return
+        waited_ms = (time.monotonic() - start) * 1000
+        if busy_timeout_ms is not None and waited_ms >= busy_timeout_ms:
+            raise TimeoutError("e-Paper still busy after %d ms" % waited_ms)
+        if _edge_detection:
+            try:
+                wait_for_edge(pin, busy_level == 0, EDGE_SLICE_MS)
+                continue
+            except (RuntimeError, ValueError, AttributeError) as e:
+                logger.debug("GPIO edge detection not available, polling BUSY: %s", e)
+                _edge_detection = False
+        delay_ms(poll_ms)
+
+
+def send_bulk(dc_pin, cs_pin, command, data):
+    # Sends command and its whole payload in a single transaction, keeping CS low in between.
+    digital_write(cs_pin, 0)
+    digital_write(dc_pin, 0)
+    spi_writebyte([command])
+    digital_write(dc_pin, 1)
+    spi_writebyte2(data)
+    digital_write(cs_pin, 1)
+
 ### END OF FILE ###